@@ -0,0 +1,110 @@
+from django.conf import settings
+from monitor.buffers import PeriodicFlusher
+
+
+class UsageAccumulator(PeriodicFlusher):
+    """
+    用电量增量累加器，同时维护 HourlyUsage / DailyUsage / MonthlyUsage 及全网合计 FleetHourlyUsage。
+
+    读数产生的电量增量先按 (meter, day, hour) 在内存中合并，
+    每 USAGE_FLUSH_INTERVAL 秒在一个事务里执行四条
+    INSERT ... ON DUPLICATE KEY UPDATE kwh = kwh + x：
+    小时、当天、当月、全网小时合计各一条。累加在数据库端完成，多个 ingest 进程同时写同一块电表也不会丢更新，
+    今天和本月的总量始终是最新的，跨天不再需要聚合查询。
+    USAGE_FLUSH_INTERVAL = 0 时每次 add 立即执行原子 upsert。
+
+    进程被强杀时最多丢失最近一个 interval 内尚未 flush 的增量，
+    可用 close_day 命令从 HourlyUsage 重新汇总校正。
+    """
+
+    name = "usage"
+
+    def __init__(self, interval):
+        super().__init__(interval)
+        self._deltas = {}   # (meter_pk, day, hour) -> kwh
+
+    def add(self, meter_pk, day, hour, kwh):
+        key = (meter_pk, day, hour)
+        with self._lock:
+            self._deltas[key] = self._deltas.get(key, 0) + kwh
+        if self.write_through:
+            self.flush()
+            return
+        self.ensure_started()
+
+    def discard(self, meter_pk):
+        """电表被删除时丢弃其未落库的增量（否则外键约束会让整批写入失败）"""
+        with self._lock:
+            for key in [k for k in self._deltas if k[0] == meter_pk]:
+                del self._deltas[key]
+
+    def _drain(self):
+        items, self._deltas = self._deltas, {}
+        return items
+
+    def _write(self, items):
+        from datetime import date
+        from django.db import transaction
+        from power.cache import trend_cache
+        from power.models import HourlyUsage, DailyUsage, MonthlyUsage, FleetHourlyUsage
+        from power.utils import bulk_increment
+
+        daily = {}
+        monthly = {}
+        fleet = {}
+        for (pk, day, hour), kwh in items.items():
+            fleet[(day, hour)] = fleet.get((day, hour), 0) + kwh
+            daily[(pk, day)] = daily.get((pk, day), 0) + kwh
+            month_key = (pk, day.year, day.month)
+            monthly[month_key] = monthly.get(month_key, 0) + kwh
+
+        with transaction.atomic():
+            bulk_increment(
+                HourlyUsage,
+                ["meter", "day", "hour"],
+                "kwh",
+                [(pk, day, hour, kwh) for (pk, day, hour), kwh in items.items()],
+            )
+            bulk_increment(
+                DailyUsage,
+                ["meter", "day"],
+                "kwh",
+                [(pk, day, kwh) for (pk, day), kwh in daily.items()],
+            )
+            bulk_increment(
+                MonthlyUsage,
+                ["meter", "year", "month"],
+                "kwh",
+                [(pk, year, month, kwh) for (pk, year, month), kwh in monthly.items()],
+            )
+            # 所有 ingest 进程都会更新同一行，放在最后以缩短行锁持有时间
+            bulk_increment(
+                FleetHourlyUsage,
+                ["day", "hour"],
+                "kwh",
+                [(day, hour, kwh) for (day, hour), kwh in sorted(fleet.items())],
+            )
+
+        # 提交后让趋势缓存失效：今天的数据只影响当前周期，晚到的历史数据连历史周期一起失效
+        today = date.today()
+        trend_cache.touch({pk for pk, day in daily if day >= today})
+        trend_cache.touch({pk for pk, day in daily if day < today}, history=True)
+
+    def _restore(self, items):
+        # 只在数据库暂时不可用时放回；key 为 (电表, 日期, 小时)，放回后与新增量合并，缓冲大小有上界
+        for key, kwh in items.items():
+            self._deltas[key] = self._deltas.get(key, 0) + kwh
+
+    def _split_invalid(self, items):
+        from power.models import Meter
+
+        pks = {pk for pk, _, _ in items}
+        existing = set(Meter.objects.filter(pk__in=pks).values_list("pk", flat=True))
+        for pk in pks - existing:
+            self.discard(pk)
+        return {k: v for k, v in items.items() if k[0] in existing}, sorted(pks - existing)
+
+
+usage_accumulator = UsageAccumulator(
+    getattr(settings, "USAGE_FLUSH_INTERVAL", 5)
+)
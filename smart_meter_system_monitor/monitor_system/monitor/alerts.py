@@ -0,0 +1,150 @@
+import threading
+from functools import partial
+import numpy as np
+from django.db import transaction
+from power.models import RealtimeAlert
+from system.utils import option_cache, get_float_option
+from monitor.consumers import make_group_name
+
+
+class AlertRules:
+    """
+    从 SystemOption 编译出的告警阈值（括号内为默认值）：
+        alert_high_power_w     功率过高阈值 W（8000）
+        alert_surge_ratio      突增比例，(当前-上次)/上次 超过该值告警（1，即翻倍）
+        alert_surge_min_w      上次功率高于该值才判断突增（1000）
+        alert_voltage_min      电压下限 V（200）
+        alert_voltage_max      电压上限 V（250）
+        alert_fluctuation_w    相邻两次功率差值阈值 W（2000）
+        alert_cooldown_s       同一电表同类告警的冷却时间 s（60）
+    """
+
+    def __init__(self):
+        self.high_power_w = get_float_option("alert_high_power_w", 8000)
+        self.surge_ratio = get_float_option("alert_surge_ratio", 1)
+        self.surge_min_w = get_float_option("alert_surge_min_w", 1000)
+        self.voltage_min = get_float_option("alert_voltage_min", 200)
+        self.voltage_max = get_float_option("alert_voltage_max", 250)
+        self.fluctuation_w = get_float_option("alert_fluctuation_w", 2000)
+        self.cooldown_s = get_float_option("alert_cooldown_s", 60)
+
+    def evaluate(self, power, voltage, last):
+        """
+        向量化判断，power / voltage / last 为等长数组（last 为 0 表示没有上次读数）。
+        返回 {alert_type: bool 数组}
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            surge_ratio = np.where(last > 0, (power - last) / last, 0)
+
+        return {
+            "high_power": power > self.high_power_w,
+            "sudden_usage": (last > self.surge_min_w) & (surge_ratio > self.surge_ratio),
+            "voltage_issue": (voltage < self.voltage_min) | (voltage > self.voltage_max),
+            "fluctuation": (last != 0) & (np.abs(power - last) > self.fluctuation_w),
+        }
+
+
+def describe(alert_type, power_w, voltage_v, last_power):
+    if alert_type == "high_power":
+        return f"功率过高：{power_w:.2f} W"
+    if alert_type == "sudden_usage":
+        return f"用电突增：{last_power:.2f} → {power_w:.2f} W"
+    if alert_type == "voltage_issue":
+        return f"电压异常：{voltage_v:.2f} V"
+    return f"功率波动异常：差值 {abs(power_w - last_power):.2f} W"
+
+
+class AlertEngine:
+    """
+    批量告警引擎：
+      1. 一次向量化计算所有读数命中的规则；
+      2. 同一电表同类告警在冷却时间内只保留第一条（防止抖动电表刷库）；
+      3. bulk_create 一次写入，按电表分组每组只推送一条 channel 消息。
+    冷却状态保存在进程内。
+    """
+
+    def __init__(self):
+        self._rules = None
+        self._rules_version = None
+        self._last_fired = {}   # (meter_pk, alert_type) -> ts
+        self._lock = threading.Lock()
+
+    @property
+    def rules(self):
+        # 配置变更（option_cache.version 变化）后重新编译
+        option_cache.all()
+        if self._rules is None or self._rules_version != option_cache.version:
+            self._rules = AlertRules()
+            self._rules_version = option_cache.version
+        return self._rules
+
+    def evaluate(self, readings):
+        """
+        readings: [(meter, power_w, voltage_v, last_power, ts), ...]
+        返回 (found, fired)：经过冷却过滤的 [(index, alert_type, desc), ...]，
+        以及本批触发的 {(meter_pk, alert_type): ts}（由 process 在事务提交后记入冷却状态）
+        """
+        if not readings:
+            return [], {}
+
+        rules = self.rules
+        power = np.array([r[1] for r in readings], dtype=float)
+        voltage = np.array([r[2] for r in readings], dtype=float)
+        last = np.array([r[3] or 0 for r in readings], dtype=float)
+
+        hits = []
+        for alert_type, mask in rules.evaluate(power, voltage, last).items():
+            hits.extend((int(i), alert_type) for i in np.flatnonzero(mask))
+        hits.sort()
+
+        found = []
+        fired = {}
+        with self._lock:
+            for i, alert_type in hits:
+                meter, power_w, voltage_v, last_power, ts = readings[i]
+                key = (meter.pk, alert_type)
+                last = fired.get(key, self._last_fired.get(key))
+                if last is not None and 0 <= ts - last < rules.cooldown_s:
+                    continue
+                fired[key] = ts
+                found.append((i, alert_type, describe(alert_type, power_w, voltage_v, last_power or 0)))
+
+        return found, fired
+
+    def _remember(self, fired):
+        with self._lock:
+            self._last_fired.update(fired)
+
+    def process(self, readings):
+        """判断 + 写库，返回 (found, messages)；冷却状态在事务提交后更新（不在事务中时立即更新）"""
+        found, fired = self.evaluate(readings)
+        if not found:
+            return found, []
+
+        RealtimeAlert.objects.bulk_create([
+            RealtimeAlert(meter=readings[i][0], type=t, desc=desc) for i, t, desc in found
+        ])
+        transaction.on_commit(partial(self._remember, fired), robust=True)
+
+        grouped = {}
+        for i, t, desc in found:
+            meter_id = readings[i][0].meter_id
+            grouped.setdefault(meter_id, []).append({
+                "type": t,
+                "desc": desc,
+                "meter_id": meter_id,
+            })
+
+        messages = [
+            (make_group_name(meter_id), {"type": "alert.batch", "alerts": alerts})
+            for meter_id, alerts in grouped.items()
+        ]
+        return found, messages
+
+    def discard(self, meter_pk):
+        with self._lock:
+            for key in [k for k in self._last_fired if k[0] == meter_pk]:
+                del self._last_fired[key]
+
+
+alert_engine = AlertEngine()
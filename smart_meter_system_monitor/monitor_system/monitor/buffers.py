@@ -0,0 +1,114 @@
+import atexit
+import threading
+from django.db import DataError, IntegrityError, close_old_connections
+
+
+class PeriodicFlusher:
+    """
+    写回缓冲基类：数据先攒在内存里，由后台守护线程按 interval 秒定时落库，
+    进程正常退出时（atexit）再 flush 一次。
+
+    子类实现：
+        _drain()          —— 在锁内取出并清空待写数据，没有数据时返回空值
+        _write(items)     —— 把取出的数据写入数据库
+        _restore(items)   —— 写库失败（数据库不可用等）时把数据放回缓冲，等待下次重试
+        _split_invalid(items) —— 可选，见下
+
+    _write 须在一个事务内完成，失败时不留下部分写入，放回缓冲重试不会重复累加。
+    数据本身导致的失败（IntegrityError / DataError，如电表已被其他进程删除）重试也不会成功，
+    放回缓冲会让之后每次 flush 都失败：这时由 _split_invalid 拆出引用已不存在电表的数据丢弃，
+    其余数据重试一次，仍然失败则整批丢弃，都会打印被丢弃的数据。
+    """
+
+    name = "flusher"
+    flush_at_exit = True
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.RLock()          # 保护缓冲数据
+        self._flush_lock = threading.Lock()     # 保证多次 flush 按顺序落库
+        self._thread = None
+        self._wake = threading.Event()
+
+    def _drain(self):
+        raise NotImplementedError
+
+    def _write(self, items):
+        raise NotImplementedError
+
+    def _restore(self, items):
+        raise NotImplementedError
+
+    def _split_invalid(self, items):
+        """返回 (可重试的数据, 被丢弃的电表 pk 列表)；默认无法拆分，整批丢弃"""
+        return None, []
+
+    @property
+    def write_through(self):
+        """interval <= 0 时不缓冲，每次写入都直接落库"""
+        return self.interval <= 0
+
+    def ensure_started(self):
+        if self.write_through or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f"{self.name}-flush", daemon=True
+            )
+            self._thread.start()
+            if self.flush_at_exit:
+                atexit.register(self.flush)
+
+    def request_flush(self):
+        """缓冲攒够一批时唤醒后台线程提前 flush，不在调用方线程里写库"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"{self.name} flush error:", e)
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                items = self._drain()
+            if not items:
+                return 0
+
+            try:
+                self._write(items)
+            except (IntegrityError, DataError) as e:
+                return self._write_valid(items, e)
+            except Exception:
+                with self._lock:
+                    self._restore(items)
+                raise
+            return len(items)
+
+    def _write_valid(self, items, error):
+        valid, dropped_pks = self._split_invalid(items)
+        if dropped_pks:
+            print(f"{self.name} flush: 电表已不存在，丢弃其数据:", dropped_pks, error)
+        if not valid:
+            if not dropped_pks:
+                print(f"{self.name} flush: 写入失败，丢弃 {len(items)} 条:", items, error)
+            return 0
+
+        try:
+            self._write(valid)
+        except (IntegrityError, DataError) as e:
+            print(f"{self.name} flush: 写入失败，丢弃 {len(valid)} 条:", valid, e)
+            return 0
+        except Exception:
+            with self._lock:
+                self._restore(valid)
+            raise
+        return len(valid)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from monitor.buffers import PeriodicFlusher
+
+REALTIME_TYPES = ("realtime.update", "realtime_update")
+
+
+class RealtimeCoalescer(PeriodicFlusher):
+    """
+    实时帧合并器：每个 group 只保留最新一帧，后台线程按 REALTIME_PUSH_MAX_RATE（帧/秒）
+    定时把有变化的 group 一次性推送出去。高频电表不再每条读数都打一次 Redis，
+    看板也不会收到超过该帧率的数据。REALTIME_PUSH_MAX_RATE = 0 时不合并，立即推送。
+
+    只合并 realtime.update 消息，告警等其他消息不受影响。
+    """
+
+    name = "realtime-push"
+    flush_at_exit = False   # 退出时的最后一帧没有意义
+
+    def __init__(self, max_rate):
+        super().__init__(1.0 / max_rate if max_rate > 0 else 0)
+        self._latest = {}   # group -> message
+
+    def absorb(self, messages):
+        """收下可合并的实时帧，返回仍需立即推送的其余消息"""
+        if self.write_through or not messages:
+            return messages
+
+        rest = []
+        with self._lock:
+            for group, message in messages:
+                if message.get("type") in REALTIME_TYPES:
+                    self._latest[group] = message
+                else:
+                    rest.append((group, message))
+        self.ensure_started()
+        return rest
+
+    def _drain(self):
+        items, self._latest = self._latest, {}
+        return items
+
+    def _write(self, items):
+        from monitor.utils import send_group_messages
+        send_group_messages(list(items.items()))
+
+    def _restore(self, items):
+        # 实时帧过期即无意义，推送失败直接丢弃，等下一帧
+        pass
+
+
+realtime_coalescer = RealtimeCoalescer(
+    getattr(settings, "REALTIME_PUSH_MAX_RATE", 4)
+)
@@ -1,9 +1,16 @@
 import time
 import re
+import asyncio
+from urllib.parse import parse_qs
 from datetime import datetime, date
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from asgiref.sync import sync_to_async
-from django.db import models
+from django.conf import settings
+from monitor.state import meter_states
+from monitor.accumulator import usage_accumulator
+from monitor.encoding import ENCODINGS, DeltaFrameEncoder, msgpack, pack
+from monitor.ringbuffer import recent_readings
+from power.cache import trend_cache
 
 
 @sync_to_async
@@ -23,18 +30,37 @@ def make_group_name(meter_id):
 # 电能计算核心逻辑
 # ======================
 
-def process_meter_update(meter, power_w):
-    """根据实时功率计算增量电量（kWh）"""
-    from power.models import DailyUsage, MonthlyUsage
+def energy_kwh(power_w, seconds):
+    """功率（W）持续 seconds 秒的电量（kWh）；支持 numpy 数组，rebuild_usage 重算时复用"""
+    hours = seconds / 3600.0        # 秒 → 小时
+    power_kw = power_w / 1000.0     # 瓦 → 千瓦
+    return power_kw * hours         # kW * h = kWh
+
+
+def process_meter_update(meter, power_w, now_ts=None, save=True):
+    """根据实时功率计算增量电量（kWh）
 
-    now_ts = time.time()
-    today = date.today()
+    now_ts: 读数时间戳，默认当前时间（批量上报时由网关提供）
+    save: 为 False 时只更新 meter 对象，由调用方统一保存
+
+    meter 需先在事务内经 meter_states.lock()（或 select_for_update 后 load()）取得最新状态，
+    更新后的状态经 meter_states 写回（默认在同一事务内直接落库）
+    """
+    if now_ts is None:
+        now_ts = time.time()
+    today = datetime.fromtimestamp(now_ts).date()
 
     # 首次数据直接记录，不计增量
     if meter.last_ts == 0:
         meter.last_ts = now_ts
         meter.last_power_w = power_w
-        meter.save()
+        if save:
+            meter_states.save(meter)
+        return 0
+
+    # 重复或乱序到达的旧读数直接忽略，不能触发跨天清零
+    delta = now_ts - meter.last_ts
+    if delta <= 0:
         return 0
 
     # 判断是否跨天
@@ -42,90 +68,176 @@ def process_meter_update(meter, power_w):
     if last_day != today:
         process_new_day(meter, last_day)
 
-    # 计算时间差（秒）
-    delta = now_ts - meter.last_ts
-    if delta <= 0:
-        return 0
-
-    # ===== 正确的 kWh 计算 =====
-    hours = delta / 3600.0          # 秒 → 小时
-    power_kw = power_w / 1000.0     # 瓦 → 千瓦
-    added_kwh = power_kw * hours    # kW * h = kWh
+    added_kwh = energy_kwh(power_w, delta)
 
     # 更新 meter（注意：这里的 energy_today 就是真实的 kWh）
     meter.energy_today += added_kwh
     meter.last_ts = now_ts
     meter.last_power_w = power_w
-    meter.save()
+    if save:
+        meter_states.save(meter)
 
     return added_kwh
 
 
 
 def process_new_day(meter, last_day):
-    from power.models import DailyUsage, MonthlyUsage, HourlyUsage
-
-    # 昨天全部小时的总和
-    total = HourlyUsage.objects.filter(
-        meter=meter, day=last_day
-    ).aggregate(total=models.Sum("kwh"))["total"] or 0
-
-    daily, _ = DailyUsage.objects.get_or_create(
-        meter=meter, day=last_day, defaults={"kwh": 0}
-    )
-    daily.kwh = total
-    daily.save()
-
-    # 月总量 = 所有 daily 总和
-    month_obj, _ = MonthlyUsage.objects.get_or_create(
-        meter=meter, year=last_day.year, month=last_day.month
-    )
-    month_total = DailyUsage.objects.filter(
-        meter=meter,
-        day__year=last_day.year,
-        day__month=last_day.month
-    ).aggregate(total=models.Sum("kwh"))["total"] or 0
-    month_obj.kwh = month_total
-    month_obj.save()
-
+    """
+    跨天处理。DailyUsage / MonthlyUsage 已由 usage_accumulator 按读数所属日期增量维护，
+    昨天剩余的增量会随下一次 flush 落到昨天的行上，这里只需清零仪表当日累计。
+    """
     # 清空仪表累计
     meter.energy_today = 0
-    meter.save()
-
-
-def record_usage(meter, added_kwh):
-    from power.models import HourlyUsage
-
-    now = datetime.now()
-    today = now.date()
-    hour = now.hour
-
-    hourly, _ = HourlyUsage.objects.get_or_create(
-        meter=meter, day=today, hour=hour, defaults={"kwh": 0}
-    )
-    hourly.kwh += added_kwh
-    hourly.save()
-
-
-
-class MeterRealtimeConsumer(AsyncJsonWebsocketConsumer):
+    meter_states.save(meter)
+    # 昨天从当前周期变成历史周期
+    trend_cache.touch([meter.pk], history=True)
+
+
+def record_usage(meter, added_kwh, now_ts=None):
+    """累加到当前小时的 HourlyUsage（经 usage_accumulator 合并后原子 upsert）"""
+    now = datetime.fromtimestamp(now_ts) if now_ts is not None else datetime.now()
+    usage_accumulator.add(meter.pk, now.date(), now.hour, added_kwh)
+
+
+
+def parse_query(scope):
+    """解析 WebSocket 连接的查询参数"""
+    return {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+
+
+class ThrottledSendMixin:
+    """
+    按客户端要求的帧率限频发送实时帧。
+    客户端可通过 ?max_rate=1 要求更低的推送帧率（帧/秒），只能比服务端上限低；
+    每个 key（电表）独立限频，等待期间只保留最新一帧。
+    """
+
+    def init_throttle(self):
+        self.min_interval = 0
+        try:
+            rate = float(parse_query(self.scope).get("max_rate", 0))
+            if rate > 0:
+                self.min_interval = 1.0 / rate
+        except ValueError:
+            pass
+        self._pending = {}
+        self._last_sent = {}
+        self._flush_tasks = {}
+
+    def cancel_throttle(self):
+        for task in self._flush_tasks.values():
+            task.cancel()
+        self._flush_tasks.clear()
+
+    def realtime_frame(self, key, data):
+        """JSON 编码下实际发送的帧，子类可包装"""
+        return data
+
+    async def send_realtime(self, key, data):
+        await self.send_json(self.realtime_frame(key, data))
+
+    async def throttled_send(self, key, data):
+        if not self.min_interval:
+            await self.send_realtime(key, data)
+            return
+
+        self._pending[key] = data
+        if key not in self._flush_tasks:
+            wait = self._last_sent.get(key, 0) + self.min_interval - time.monotonic()
+            if wait <= 0:
+                await self._send_pending(key)
+            else:
+                self._flush_tasks[key] = asyncio.create_task(self._flush_later(key, wait))
+
+    async def _flush_later(self, key, wait):
+        await asyncio.sleep(wait)
+        self._flush_tasks.pop(key, None)
+        await self._send_pending(key)
+
+    async def _send_pending(self, key):
+        data = self._pending.pop(key, None)
+        if data is not None:
+            self._last_sent[key] = time.monotonic()
+            await self.send_realtime(key, data)
+
+
+class CompactEncodingMixin:
+    """
+    可选的压缩协议，连接时通过 ?encoding= 选择：
+        json     默认，原样 send_json
+        delta    JSON 文本，增量帧 + 周期关键帧（格式见 monitor.encoding）
+        msgpack  与 delta 相同的帧，用 MessagePack 二进制发送（未安装 msgpack 时退化为 delta）
+    告警等其他消息仍为 JSON 文本。
+    """
+
+    async def init_encoding(self):
+        encoding = parse_query(self.scope).get("encoding", "json")
+        if encoding not in ENCODINGS:
+            encoding = "json"
+        if encoding == "msgpack" and msgpack is None:
+            encoding = "delta"
+
+        self.encoding = encoding
+        self.encoder = None
+        if encoding != "json":
+            self.encoder = DeltaFrameEncoder(getattr(settings, "WS_KEYFRAME_INTERVAL", 30))
+            # 告知客户端实际生效的编码
+            await self.send_json({
+                "type": "encoding",
+                "encoding": encoding,
+                "keyframe_interval": self.encoder.keyframe_interval
+            })
+
+    async def send_backlog(self, meter_id):
+        """连接/订阅时下发最近 WS_BACKLOG_SECONDS 秒的读数（列式），?backlog=0 关闭"""
+        seconds = getattr(settings, "WS_BACKLOG_SECONDS", 600)
+        if not seconds or parse_query(self.scope).get("backlog") == "0":
+            return
+
+        series = recent_readings.series(meter_id, seconds)
+        if not series["ts"]:
+            return
+
+        frame = {"type": "backlog", "meter_id": meter_id, **series}
+        if self.encoding == "msgpack":
+            await self.send(bytes_data=pack(frame, single_float=False))
+        else:
+            await self.send_json(frame)
+
+    async def send_realtime(self, key, data):
+        if self.encoder is None:
+            await super().send_realtime(key, data)
+            return
+
+        frame = self.encoder.encode(key, data)
+        if self.encoding == "msgpack":
+            await self.send(bytes_data=pack(frame))
+        else:
+            await self.send_json(frame)
+
+
+class MeterRealtimeConsumer(CompactEncodingMixin, ThrottledSendMixin, AsyncJsonWebsocketConsumer):
 
     async def connect(self):
         self.meter_id = self.scope["url_route"]["kwargs"]["meter_id"]
         self.group_name = make_group_name(self.meter_id)
+        self.init_throttle()
 
         print("WS CONNECT → GROUP =", self.group_name)
 
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
+        await self.init_encoding()
+        await self.send_backlog(self.meter_id)
 
     async def disconnect(self, code):
+        self.cancel_throttle()
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def realtime_update(self, event):
         """发送给前端"""
         # print("WS PUSH → FRONTEND:", event["data"])
-        await self.send_json(event["data"])
+        await self.throttled_send(self.meter_id, event["data"])
 
     async def alert_message(self, event):
         """实时异常推送到前端"""
@@ -133,3 +245,137 @@ class MeterRealtimeConsumer(AsyncJsonWebsocketConsumer):
             "type": "alert",
             "alert": event["alert"]
         })
+
+    async def alert_batch(self, event):
+        """批量告警：一条 channel 消息携带多条告警，逐条推送给前端"""
+        for alert in event["alerts"]:
+            await self.send_json({
+                "type": "alert",
+                "alert": alert
+            })
+
+
+@sync_to_async
+def get_token_user(token):
+    """用 JWT access token 换取用户，无效时返回 None"""
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+    auth = JWTAuthentication()
+    try:
+        return auth.get_user(auth.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+@sync_to_async
+def get_user_meter_ids(user):
+    return list(user.meters.values_list("meter_id", flat=True))
+
+
+class MultiMeterConsumer(CompactEncodingMixin, ThrottledSendMixin, AsyncJsonWebsocketConsumer):
+    """
+    一个连接订阅多块电表：ws/monitor/meters/?token=<access>&max_rate=2&encoding=msgpack
+
+    客户端消息：
+        {"action": "subscribe", "meter_ids": ["M1", "M2"]}
+        {"action": "subscribe", "mine": true}          # 当前用户的全部电表，需要登录
+        {"action": "unsubscribe", "meter_ids": ["M1"]}
+        {"action": "unsubscribe_all"}
+    推送帧都带 meter_id：
+        {"type": "realtime", "meter_id": "M1", "data": {...}}
+        {"type": "alert", "meter_id": "M1", "alert": {...}}
+    """
+
+    async def connect(self):
+        self.subscriptions = {}   # meter_id -> group
+        self.user = self.scope.get("user")
+        token = parse_query(self.scope).get("token")
+        if token:
+            self.user = await get_token_user(token)
+        self.init_throttle()
+        await self.accept()
+        await self.init_encoding()
+
+    async def disconnect(self, code):
+        self.cancel_throttle()
+        for group in self.subscriptions.values():
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.subscriptions.clear()
+
+    async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict):
+            await self.send_json({"type": "error", "error": "message must be a JSON object"})
+            return
+        meter_ids = content.get("meter_ids") or []
+        if not isinstance(meter_ids, list):
+            await self.send_json({"type": "error", "error": "meter_ids must be a list"})
+            return
+
+        action = content.get("action")
+        meter_ids = [str(m) for m in meter_ids]
+
+        if action == "subscribe":
+            if content.get("mine"):
+                if not self.user or not self.user.is_authenticated:
+                    await self.send_json({"type": "error", "error": "login required"})
+                    return
+                meter_ids += await get_user_meter_ids(self.user)
+            await self.subscribe(meter_ids)
+        elif action == "unsubscribe":
+            await self.unsubscribe(meter_ids)
+        elif action == "unsubscribe_all":
+            await self.unsubscribe(list(self.subscriptions))
+        else:
+            await self.send_json({"type": "error", "error": "unknown action"})
+            return
+
+        await self.send_json({"type": "subscribed", "meter_ids": sorted(self.subscriptions)})
+
+    async def subscribe(self, meter_ids):
+        limit = getattr(settings, "WS_MAX_SUBSCRIPTIONS", 500)
+        for meter_id in meter_ids:
+            if meter_id in self.subscriptions:
+                continue
+            if len(self.subscriptions) >= limit:
+                await self.send_json({"type": "error", "error": f"too many subscriptions (max {limit})"})
+                break
+            group = make_group_name(meter_id)
+            self.subscriptions[meter_id] = group
+            await self.channel_layer.group_add(group, self.channel_name)
+            await self.send_backlog(meter_id)
+
+    async def unsubscribe(self, meter_ids):
+        for meter_id in meter_ids:
+            group = self.subscriptions.pop(meter_id, None)
+            if group:
+                await self.channel_layer.group_discard(group, self.channel_name)
+            self._pending.pop(meter_id, None)
+            if self.encoder:
+                self.encoder.forget(meter_id)
+
+    def realtime_frame(self, key, data):
+        return {
+            "type": "realtime",
+            "meter_id": key,
+            "data": data
+        }
+
+    async def realtime_update(self, event):
+        data = event["data"]
+        await self.throttled_send(data.get("meter_id"), data)
+
+    async def alert_message(self, event):
+        await self.send_json({
+            "type": "alert",
+            "meter_id": event["alert"].get("meter_id"),
+            "alert": event["alert"]
+        })
+
+    async def alert_batch(self, event):
+        for alert in event["alerts"]:
+            await self.send_json({
+                "type": "alert",
+                "meter_id": alert.get("meter_id"),
+                "alert": alert
+            })
@@ -0,0 +1,90 @@
+try:
+    import msgpack
+except ImportError:  # 可选依赖，未安装时 msgpack 编码退化为 delta JSON
+    msgpack = None
+
+ENCODINGS = ("json", "delta", "msgpack")
+# 累计电量等累计值字段：float32 只有约 7 位有效数字，累计值变大后会丢失精度，msgpack 中始终按 float64 编码
+DOUBLE_FIELDS = ("e",)
+
+
+class DeltaFrameEncoder:
+    """
+    实时帧压缩编码（每个 WebSocket 连接一个实例，按电表记录上次发送的状态）。
+
+    帧格式：
+        k  1 = 关键帧（包含全部设备），0 = 增量帧（只包含有变化的设备）
+        m  meter_id
+        s  该电表的帧序号
+        p / v / c / e  总功率 W / 电压 V / 电流 A / 累计电量 kWh（来自 _TOTAL）
+        d  {设备名: [power_w, on(0/1)]}
+        x  增量帧中已消失的设备名列表
+    每 keyframe_interval 帧发送一次关键帧，客户端丢帧或刚连上时可据此恢复完整状态；
+    keyframe_interval <= 1 时每帧都是关键帧。
+    """
+
+    def __init__(self, keyframe_interval=30):
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self._devices = {}   # meter_id -> {name: [power_w, on]}
+        self._seq = {}       # meter_id -> 已发送帧数
+
+    def encode(self, meter_id, data):
+        devices = data.get("devices")
+        if not isinstance(devices, dict):
+            # 非标准格式（如 realtime_collect 原样转发的 body）不做压缩
+            return data
+
+        total = devices.get("_TOTAL") or {}
+        current = {}
+        for name, dev in devices.items():
+            if name == "_TOTAL" or not isinstance(dev, dict):
+                continue
+            current[name] = [dev.get("power_w", 0), 1 if dev.get("on") else 0]
+
+        seq = self._seq.get(meter_id, 0)
+        previous = self._devices.get(meter_id)
+        keyframe = previous is None or seq % self.keyframe_interval == 0
+
+        frame = {
+            "k": 1 if keyframe else 0,
+            "m": meter_id,
+            "s": seq,
+            "p": data.get("power_w", total.get("power_w", 0)),
+            "v": data.get("voltage_v", total.get("voltage_v", 0)),
+            "c": data.get("current_a", total.get("current_a", 0)),
+        }
+        if "energy_kwh_total" in total:
+            frame["e"] = total["energy_kwh_total"]
+
+        if keyframe:
+            frame["d"] = current
+        else:
+            frame["d"] = {n: v for n, v in current.items() if previous.get(n) != v}
+            removed = [n for n in previous if n not in current]
+            if removed:
+                frame["x"] = removed
+
+        self._devices[meter_id] = current
+        self._seq[meter_id] = seq + 1
+        return frame
+
+    def forget(self, meter_id):
+        self._devices.pop(meter_id, None)
+        self._seq.pop(meter_id, None)
+
+
+def pack(frame, single_float=True):
+    """
+    msgpack 编码，默认浮点数用 float32 进一步压缩（时间戳等需要精度时传 False），
+    DOUBLE_FIELDS 中的字段始终按 float64 编码
+    """
+    if not single_float or not any(k in frame for k in DOUBLE_FIELDS):
+        return msgpack.packb(frame, use_single_float=single_float)
+
+    single = msgpack.Packer(use_single_float=True)
+    double = msgpack.Packer(use_single_float=False)
+    parts = [single.pack_map_header(len(frame))]
+    for key, value in frame.items():
+        parts.append(single.pack(key))
+        parts.append((double if key in DOUBLE_FIELDS else single).pack(value))
+    return b"".join(parts)
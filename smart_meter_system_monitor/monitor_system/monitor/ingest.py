@@ -0,0 +1,183 @@
+import math
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from power.models import Meter
+from monitor.consumers import process_meter_update, record_usage
+from monitor.state import meter_states
+from monitor.utils import make_group_name
+from monitor.alerts import alert_engine
+from monitor.ringbuffer import recent_readings
+from monitor.rawlog import raw_readings
+
+
+def realtime_message(meter_id, payload):
+    """构造推送给 Consumer.realtime_update 的消息"""
+    total = payload["_TOTAL"]
+    return {
+        "type": "realtime.update",
+        "data": {
+            "meter_id": meter_id,
+            "power_w": float(total.get("power_w", 0)),
+            "voltage_v": float(total.get("voltage_v", 0)),
+            "current_a": total.get("current_a", 0),
+            "devices": payload
+        }
+    }
+
+
+def _finite(value, name):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return value
+
+
+def parse_reading(item):
+    """校验单条读数，返回 (meter_id, payload, ts)，非法时抛 ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError("reading must be an object")
+
+    meter_id = item.get("meter_id")
+    payload = item.get("data") or {}
+    if not meter_id or not isinstance(payload, dict) or "_TOTAL" not in payload:
+        raise ValueError("invalid payload")
+
+    total = payload["_TOTAL"]
+    _finite(total.get("power_w", 0), "power_w")
+    _finite(total.get("voltage_v", 0), "voltage_v")
+
+    ts = item.get("ts")
+    if ts is not None:
+        ts = _finite(ts, "ts")
+        # 超出范围的时间戳会让 datetime.fromtimestamp 在事务中途抛错，导致整批失败
+        if not 0 < ts <= time.time() + getattr(settings, "INGEST_MAX_CLOCK_SKEW", 300):
+            raise ValueError("ts out of range")
+    return str(meter_id), payload, ts
+
+
+def ingest_readings(readings):
+    """
+    批量写入多块电表的读数（单个事务）。
+    累加器、最近读数、原始读数等进程内状态在事务提交后才更新：
+    事务回滚时不留下副作用，网关重试同一批也不会重复累加。
+    返回 (results, messages)：
+        results  —— 与输入一一对应的处理结果
+        messages —— 事务提交后需要推送的 [(group, message), ...]
+    """
+    results = [None] * len(readings)
+    parsed = []
+
+    for i, item in enumerate(readings):
+        try:
+            meter_id, payload, ts = parse_reading(item)
+        except (ValueError, TypeError, AttributeError) as e:
+            results[i] = {"index": i, "ok": False, "error": str(e)}
+            continue
+        parsed.append((i, meter_id, payload, ts))
+
+    if not parsed:
+        return results, []
+
+    now_ts = time.time()
+    # 同一电表按时间顺序处理，保证增量电量正确
+    parsed.sort(key=lambda p: (p[1], p[3] if p[3] is not None else now_ts))
+
+    meter_ids = {p[1] for p in parsed}
+    alert_inputs = []
+    latest = {}
+    deferred = []
+
+    with transaction.atomic():
+        # 不存在的电表一次性创建
+        known = set(Meter.objects.filter(meter_id__in=meter_ids).values_list("meter_id", flat=True))
+        missing = meter_ids - known
+        if missing:
+            Meter.objects.bulk_create([Meter(meter_id=m) for m in missing], ignore_conflicts=True)
+
+        meters = {
+            m.meter_id: meter_states.load(m)
+            for m in Meter.objects.select_for_update().filter(meter_id__in=meter_ids).order_by("pk")
+        }
+
+        for i, meter_id, payload, ts in parsed:
+            meter = meters[meter_id]
+            total = payload["_TOTAL"]
+            power_w = float(total.get("power_w", 0))
+            voltage_v = float(total.get("voltage_v", 0))
+            reading_ts = ts if ts is not None else now_ts
+
+            last_power = meter.last_power_w
+            added = process_meter_update(meter, power_w, now_ts=reading_ts, save=False)
+
+            # 小时增量进入累加器，按 (meter, day, hour) 合并后批量 upsert
+            if added > 0:
+                deferred.append(partial(record_usage, meter, added, now_ts=reading_ts))
+
+            deferred.append(partial(recent_readings.record, meter_id, reading_ts, power_w, voltage_v))
+            deferred.append(partial(raw_readings.add, meter, reading_ts, power_w))
+            alert_inputs.append((meter, power_w, voltage_v, last_power, reading_ts))
+            latest[meter_id] = payload
+            results[i] = {
+                "index": i,
+                "meter_id": meter_id,
+                "ok": True,
+                "added_kwh": added,
+                "alerts": [],
+            }
+
+        meter_states.save_many(meters.values())
+
+        # 全部读数一次性判断告警并批量写入
+        found, alert_messages = alert_engine.process(alert_inputs)
+        for n, t, _ in found:
+            results[parsed[n][0]]["alerts"].append(t)
+
+        for fn in deferred:
+            transaction.on_commit(fn, robust=True)
+
+    # 每块电表只推送本批次最新一帧
+    messages = [
+        (make_group_name(meter_id), realtime_message(meter_id, payload))
+        for meter_id, payload in latest.items()
+    ]
+    messages += alert_messages
+
+    return results, messages
+
+
+# ======================
+# 异步入口：DB 工作放到专用线程池
+# ======================
+
+_executor = None
+
+
+def get_ingest_executor():
+    """入库专用线程池，大小由 INGEST_DB_WORKERS 控制"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "INGEST_DB_WORKERS", 8),
+            thread_name_prefix="ingest-db",
+        )
+    return _executor
+
+
+def _ingest_in_worker(readings):
+    # 线程池中的数据库连接不会随请求关闭，需要手动回收失效连接
+    close_old_connections()
+    try:
+        return ingest_readings(readings)
+    finally:
+        close_old_connections()
+
+
+async def aingest_readings(readings):
+    """ingest_readings 的异步版本，不占用 ASGI 事件循环和默认同步线程"""
+    return await sync_to_async(
+        _ingest_in_worker, thread_sensitive=False, executor=get_ingest_executor()
+    )(readings)
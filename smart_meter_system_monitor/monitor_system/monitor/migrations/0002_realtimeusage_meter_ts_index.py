@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0001_initial'),
+        ('power', '0008_realtimealert_bill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='realtimeusage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='时间'),
+        ),
+        migrations.AddIndex(
+            model_name='realtimeusage',
+            index=models.Index(fields=['meter', 'timestamp'], name='realtime_meter_ts_idx'),
+        ),
+    ]
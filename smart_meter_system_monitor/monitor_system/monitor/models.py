@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from power.models import Meter
 from django.conf import settings
 User = settings.AUTH_USER_MODEL
@@ -14,12 +15,15 @@ class RealtimeUsage(models.Model):
         related_name='realtime_records',
         verbose_name='电表'
     )
-    timestamp = models.DateTimeField('时间', auto_now_add=True)
+    timestamp = models.DateTimeField('时间', default=timezone.now)
     power_usage = models.IntegerField('总功率(W)')
 
     class Meta:
         db_table = 'realtime_usage'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['meter', 'timestamp'], name='realtime_meter_ts_idx'),
+        ]
         verbose_name = '实时用电记录'
         verbose_name_plural = verbose_name
 
@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+from django.conf import settings
+from monitor.buffers import PeriodicFlusher
+
+
+class RawReadingWriter(PeriodicFlusher):
+    """
+    原始读数落盘（monitor.RealtimeUsage），供后续重算/分析使用。
+
+      - 采样：每块电表每 RAW_READING_SAMPLE_EVERY 条读数记录 1 条（1 = 全部记录，0 = 关闭）；
+      - 批量：读数先进内存缓冲，最长 RAW_READING_FLUSH_INTERVAL 秒或攒够
+        RAW_READING_BATCH_SIZE 条时由后台线程 bulk_create，上报请求本身不写库；
+      - 数据库不可用时缓冲最多保留 RAW_READING_MAX_BUFFER 条，超出部分丢弃。
+    """
+
+    name = "raw-readings"
+
+    def __init__(self, interval, sample_every, batch_size, max_buffer):
+        super().__init__(interval)
+        self.sample_every = sample_every
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._rows = []       # (meter_pk, ts, power_w)
+        self._counters = {}   # meter_pk -> 已收到读数条数（用于 1-in-N 采样）
+        self.dropped = 0
+
+    def add(self, meter, ts, power_w):
+        if self.sample_every <= 0:
+            return
+
+        with self._lock:
+            n = self._counters.get(meter.pk, 0)
+            self._counters[meter.pk] = n + 1
+            if n % self.sample_every:
+                return
+            self._rows.append((meter.pk, ts, power_w))
+            full = len(self._rows) >= self.batch_size
+
+        if self.write_through:
+            self.flush()
+            return
+        self.ensure_started()
+        if full:
+            self.request_flush()
+
+    def discard(self, meter_pk):
+        with self._lock:
+            self._rows = [r for r in self._rows if r[0] != meter_pk]
+            self._counters.pop(meter_pk, None)
+
+    def _drain(self):
+        items, self._rows = self._rows, []
+        return items
+
+    def _write(self, items):
+        from django.db import transaction
+        from monitor.models import RealtimeUsage
+
+        with transaction.atomic():
+            RealtimeUsage.objects.bulk_create(
+                [
+                    RealtimeUsage(
+                        meter_id=pk,
+                        timestamp=datetime.fromtimestamp(ts, tz=timezone.utc),
+                        power_usage=round(power_w),
+                    )
+                    for pk, ts, power_w in items
+                ],
+                batch_size=self.batch_size,
+            )
+
+    def _restore(self, items):
+        # 放回缓冲头部，超过上限时丢弃最旧的
+        room = max(self.max_buffer - len(self._rows), 0)
+        if room < len(items):
+            self.dropped += len(items) - room
+            items = items[len(items) - room:]
+        self._rows[:0] = items
+
+    def _split_invalid(self, items):
+        from power.models import Meter
+
+        pks = {r[0] for r in items}
+        existing = set(Meter.objects.filter(pk__in=pks).values_list("pk", flat=True))
+        for pk in pks - existing:
+            self.discard(pk)
+        return [r for r in items if r[0] in existing], sorted(pks - existing)
+
+
+raw_readings = RawReadingWriter(
+    getattr(settings, "RAW_READING_FLUSH_INTERVAL", 2),
+    getattr(settings, "RAW_READING_SAMPLE_EVERY", 1),
+    getattr(settings, "RAW_READING_BATCH_SIZE", 1000),
+    getattr(settings, "RAW_READING_MAX_BUFFER", 100000),
+)
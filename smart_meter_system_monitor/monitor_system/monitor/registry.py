@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from monitor.state import meter_states
+from system.utils import _redis_client
+
+REGISTRY_CHANNEL = "meter_registry:changed"
+
+
+class MeterRegistry:
+    """
+    meter_id -> Meter 行的进程内 LRU 缓存，避免每条读数都查一次 Meter 表。
+
+    缓存的是加载时的整行字段，取出时重新构造 Meter 实例（线程间不共享对象），
+    并用 meter_states 中的热状态覆盖 last_ts / last_power_w / energy_today
+    （计量前还要经 meter_states.lock() 读取数据库中的最新状态）。
+
+    失效方式（与 system.utils.OptionCache 一致）：
+      - 电表新增、修改、删除时由 monitor.signals 立即失效本进程缓存，事务提交后通过 Redis 发布通知；
+      - 其他进程的后台线程订阅该频道，收到通知后失效本地缓存，电表被删除时同时丢弃其各写回缓冲中的数据；
+      - Redis 不可用时退化为 TTL（METER_REGISTRY_TTL 秒）过期重新加载。
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rows = OrderedDict()   # meter_id -> (field_names, values, loaded_at)
+        self._lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+
+    def _build(self, row):
+        from power.models import Meter
+
+        names, values, _ = row
+        meter = Meter.from_db(DEFAULT_DB_ALIAS, names, values)
+        return meter_states.load(meter)
+
+    def _remember(self, meter):
+        names = [f.attname for f in meter._meta.concrete_fields]
+        row = (names, tuple(getattr(meter, n) for n in names), time.monotonic())
+        with self._lock:
+            self._rows[meter.meter_id] = row
+            self._rows.move_to_end(meter.meter_id)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+
+    def _cached(self, meter_id):
+        self._ensure_listener()
+        with self._lock:
+            row = self._rows.get(meter_id)
+            if row is not None and time.monotonic() - row[2] > self.ttl:
+                del self._rows[meter_id]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._rows.move_to_end(meter_id)
+            self.hits += 1
+        return self._build(row)
+
+    def get(self, meter_id):
+        """按 meter_id 取电表，不存在返回 None（不存在的结果不缓存）"""
+        from power.models import Meter
+
+        if not meter_id:
+            return None
+
+        meter_id = str(meter_id)
+        meter = self._cached(meter_id)
+        if meter is not None:
+            return meter
+
+        meter = Meter.objects.filter(meter_id=meter_id).first()
+        if meter is None:
+            return None
+        self._remember(meter)
+        return meter_states.load(meter)
+
+    def get_or_create(self, meter_id):
+        from power.models import Meter
+
+        meter_id = str(meter_id)
+        meter = self._cached(meter_id)
+        if meter is not None:
+            return meter, False
+
+        meter, created = Meter.objects.get_or_create(meter_id=meter_id)
+        self._remember(meter)
+        return meter_states.load(meter), created
+
+    def invalidate(self, meter_id):
+        with self._lock:
+            self._rows.pop(str(meter_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    # ---------- 跨进程通知 ----------
+
+    def publish(self, meter_id, meter_pk, deleted=False):
+        """通知其他进程电表已变更（deleted 时其他进程同时丢弃该电表的缓冲数据）"""
+        try:
+            client = _redis_client()
+            if client is not None:
+                client.publish(REGISTRY_CHANNEL, json.dumps(
+                    {"meter_id": str(meter_id), "pk": meter_pk, "deleted": deleted}
+                ))
+        except Exception as e:
+            print("registry publish error:", e)
+
+    def _ensure_listener(self):
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(
+                target=self._listen, name="registry-listener", daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                client = _redis_client()
+                if client is None:
+                    return   # 没有 redis 依赖，只靠 TTL
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REGISTRY_CHANNEL)
+                # 订阅期间可能错过通知，订阅成功后主动清空一次
+                self.clear()
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._on_message(message["data"])
+            except Exception as e:
+                print("registry listener error:", e)
+            time.sleep(5)
+
+    def _on_message(self, data):
+        from monitor.signals import forget_meter
+
+        change = json.loads(data)
+        if change.get("deleted"):
+            forget_meter(change["meter_id"], change["pk"])
+        else:
+            self.invalidate(change["meter_id"])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0,
+        }
+
+
+meter_registry = MeterRegistry(
+    getattr(settings, "METER_REGISTRY_SIZE", 10000),
+    getattr(settings, "METER_REGISTRY_TTL", 300),
+)
@@ -0,0 +1,96 @@
+import threading
+import time
+from array import array
+from django.conf import settings
+
+
+class ReadingRing:
+    """
+    单块电表的定长环形缓冲，array 连续存储（时间戳 float64，功率/电压 float32），
+    600 条约占 9.6 KB，写入 O(1)，写满后覆盖最旧的数据。
+    """
+
+    __slots__ = ("capacity", "ts", "power", "voltage", "pos", "count")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))
+        self.power = array("f", bytes(4 * capacity))
+        self.voltage = array("f", bytes(4 * capacity))
+        self.pos = 0
+        self.count = 0
+
+    def append(self, ts, power_w, voltage_v):
+        i = self.pos
+        self.ts[i] = ts
+        self.power[i] = power_w
+        self.voltage[i] = voltage_v
+        self.pos = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def snapshot(self, since=None):
+        """按时间顺序返回 (ts, power, voltage) 三个列表"""
+        start = (self.pos - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            order = range(start, start + self.count)
+        else:
+            order = list(range(start, self.capacity)) + list(range(0, self.pos))
+
+        ts, power, voltage = [], [], []
+        for i in order:
+            if since is not None and self.ts[i] < since:
+                continue
+            ts.append(self.ts[i])
+            power.append(self.power[i])
+            voltage.append(self.voltage[i])
+        return ts, power, voltage
+
+
+class RecentReadings:
+    """
+    每块电表最近 RECENT_READINGS_SIZE 条读数（默认 600 条，即 1Hz 下最近 10 分钟）。
+    由上报入口写入，WebSocket 连接时下发 backlog、recent 接口直接读取，不查数据库。
+
+    数据保存在进程内，不跨进程共享：多进程 / 多实例部署时，每个进程只有经它上报的读数，
+    请求落到其他进程时读到的是不完整（甚至为空）的序列。recent 接口在响应中以 scope / pid 标明这一点；
+    需要完整数据时用 /power/trend/range（HourlyUsage）或 RealtimeUsage 原始读数。
+    单进程部署（或网关上报与读取固定路由到同一进程）时数据完整。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def record(self, meter_id, ts, power_w, voltage_v):
+        with self._lock:
+            ring = self._rings.get(meter_id)
+            if ring is None:
+                ring = self._rings[meter_id] = ReadingRing(self.capacity)
+            ring.append(ts, power_w, voltage_v)
+
+    def series(self, meter_id, seconds=None):
+        """返回列式数据 {"ts": [...], "power_w": [...], "voltage_v": [...]}"""
+        since = time.time() - seconds if seconds else None
+        with self._lock:
+            ring = self._rings.get(meter_id)
+            if ring is None:
+                ts, power, voltage = [], [], []
+            else:
+                ts, power, voltage = ring.snapshot(since)
+
+        return {
+            "ts": [round(t, 3) for t in ts],
+            "power_w": [round(p, 2) for p in power],
+            "voltage_v": [round(v, 2) for v in voltage],
+        }
+
+    def discard(self, meter_id):
+        with self._lock:
+            self._rings.pop(meter_id, None)
+
+
+recent_readings = RecentReadings(
+    getattr(settings, "RECENT_READINGS_SIZE", 600)
+)
@@ -1,6 +1,7 @@
 from django.urls import re_path
-from .consumers import MeterRealtimeConsumer
+from .consumers import MeterRealtimeConsumer, MultiMeterConsumer
 
 websocket_urlpatterns = [
     re_path(r"^/?ws/monitor/meter/(?P<meter_id>[\w.-]+)/?$", MeterRealtimeConsumer.as_asgi()),
+    re_path(r"^/?ws/monitor/meters/?$", MultiMeterConsumer.as_asgi()),
 ]
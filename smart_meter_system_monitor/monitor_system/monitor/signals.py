@@ -0,0 +1,38 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from power.models import Meter
+from monitor.state import meter_states
+from monitor.registry import meter_registry
+from monitor.accumulator import usage_accumulator
+from monitor.alerts import alert_engine
+from monitor.ringbuffer import recent_readings
+from monitor.rawlog import raw_readings
+
+
+@receiver(post_save, sender=Meter)
+def meter_saved(sender, instance, update_fields=None, **kwargs):
+    """电表新增或修改（如绑定用户）后让注册表重新加载，并通知其他进程"""
+    # 每条读数写穿的热状态不需要失效：计量前总会经 meter_states.lock() 重新读取
+    if update_fields and set(update_fields) <= set(meter_states.FIELDS):
+        return
+    meter_registry.invalidate(instance.meter_id)
+    transaction.on_commit(partial(meter_registry.publish, instance.meter_id, instance.pk))
+
+
+@receiver(post_delete, sender=Meter)
+def meter_deleted(sender, instance, **kwargs):
+    """电表删除后清理进程内缓存，并通知其他进程"""
+    forget_meter(instance.meter_id, instance.pk)
+    transaction.on_commit(partial(meter_registry.publish, instance.meter_id, instance.pk, deleted=True))
+
+
+def forget_meter(meter_id, meter_pk):
+    """丢弃本进程中该电表的注册表缓存和各写回缓冲数据"""
+    meter_registry.invalidate(meter_id)
+    meter_states.discard(meter_pk)
+    usage_accumulator.discard(meter_pk)
+    alert_engine.discard(meter_pk)
+    recent_readings.discard(meter_id)
+    raw_readings.discard(meter_pk)
@@ -0,0 +1,104 @@
+from django.conf import settings
+from monitor.buffers import PeriodicFlusher
+
+
+class MeterStateStore(PeriodicFlusher):
+    """
+    电表热状态（last_ts / last_power_w / energy_today）的读写入口。
+
+    默认 METER_STATE_FLUSH_INTERVAL = 0（写穿）：Meter 表是唯一的权威状态，
+    读数处理前用 lock() 在事务内 select_for_update 读出最新状态，处理后在同一事务内写回，
+    多个 worker / 进程处理同一块电表时串行执行，不会用过期的 last_ts 重复计量。
+
+    METER_STATE_FLUSH_INTERVAL > 0 时改为进程内写回缓存：每条读数只更新内存，
+    后台线程每 interval 秒把有变化的电表用一条 bulk_update 写回 Meter 表；进程正常退出时会再 flush 一次。
+    只适用于单进程部署（或同一块电表的读数固定由同一个进程处理），
+    否则各进程会以各自的 last_ts 计算增量，电量重复计入。
+
+    写回缓存的崩溃语义：
+      - 进程被强杀时最多丢失最近一个 interval 内的状态更新，Meter 表停留在上次 flush 的值；
+      - 重启后第一条读数会用旧的 last_ts 计算时间差，这段时间的电量按当前功率估算后
+        仍会计入 HourlyUsage；
+      - HourlyUsage 增量由 usage_accumulator 独立缓冲，两者 flush 时刻不同，
+        崩溃时该段电量可能少计或重复计入，误差不超过一个 flush 周期的用电量；
+      - energy_today 只用于实时展示，跨天汇总以 HourlyUsage 为准。
+    """
+
+    name = "meter-state"
+    FIELDS = ("last_ts", "last_power_w", "energy_today")
+
+    def __init__(self, interval):
+        super().__init__(interval)
+        self._states = {}   # meter pk -> (last_ts, last_power_w, energy_today)
+        self._dirty = set()
+
+    def load(self, meter):
+        """用缓存中的最新状态覆盖从数据库读出的 meter 字段"""
+        with self._lock:
+            state = self._states.get(meter.pk)
+        if state is not None:
+            meter.last_ts, meter.last_power_w, meter.energy_today = state
+        return meter
+
+    def lock(self, meter):
+        """
+        在事务内锁定电表行并读出最新热状态覆盖 meter（注册表缓存的字段可能已被其他进程更新），
+        须在 transaction.atomic() 内调用，处理完读数后在同一事务内 save()
+        """
+        from power.models import Meter
+
+        state = Meter.objects.select_for_update().filter(pk=meter.pk).values_list(*self.FIELDS).first()
+        if state is not None:
+            meter.last_ts, meter.last_power_w, meter.energy_today = state
+        return self.load(meter)
+
+    def save_many(self, meters):
+        """批量记录状态：写穿时一条 bulk_update 落库"""
+        if self.write_through:
+            self._write({m.pk: (m.last_ts, m.last_power_w, m.energy_today) for m in meters})
+            return
+        for meter in meters:
+            self.save(meter)
+
+    def save(self, meter):
+        """记录 meter 的最新状态，稍后统一落库"""
+        if self.write_through:
+            meter.save(update_fields=list(self.FIELDS))
+            return
+
+        with self._lock:
+            self._states[meter.pk] = (meter.last_ts, meter.last_power_w, meter.energy_today)
+            self._dirty.add(meter.pk)
+        self.ensure_started()
+
+    def discard(self, meter_pk):
+        """电表被删除时丢弃其缓存状态"""
+        with self._lock:
+            self._states.pop(meter_pk, None)
+            self._dirty.discard(meter_pk)
+
+    def _drain(self):
+        items = {pk: self._states[pk] for pk in self._dirty if pk in self._states}
+        self._dirty.clear()
+        return items
+
+    def _write(self, items):
+        from power.models import Meter
+
+        Meter.objects.bulk_update(
+            [
+                Meter(pk=pk, last_ts=last_ts, last_power_w=last_power_w, energy_today=energy_today)
+                for pk, (last_ts, last_power_w, energy_today) in items.items()
+            ],
+            list(self.FIELDS),
+            batch_size=500,
+        )
+
+    def _restore(self, items):
+        # _states 中始终是最新值，重新标记为待写即可，下次 flush 写入最新状态
+        self._dirty.update(pk for pk in items if pk in self._states)
+
+
+meter_states = MeterStateStore(
+    getattr(settings, "METER_STATE_FLUSH_INTERVAL", 0)
+)
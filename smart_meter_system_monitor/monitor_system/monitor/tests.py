@@ -1,3 +1,295 @@
-from django.test import TestCase
+import json
+import os
+import time
+from datetime import date
+from unittest import mock
+from django.db import OperationalError
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase
+from monitor.accumulator import usage_accumulator
+from monitor.alerts import alert_engine
+from monitor.consumers import MultiMeterConsumer
+from monitor.encoding import DeltaFrameEncoder, msgpack, pack
+from monitor.ingest import ingest_readings, parse_reading
+from monitor.rawlog import raw_readings
+from monitor.registry import meter_registry
+from monitor.ringbuffer import recent_readings
+from monitor.state import meter_states
+from monitor.models import RealtimeUsage
+from power.models import HourlyUsage, Meter
+from user.models import User
 
-# Create your tests here.
+
+def reading(meter_id, ts, power_w=1000, voltage_v=220):
+    return {"meter_id": meter_id, "ts": ts, "data": {"_TOTAL": {"power_w": power_w, "voltage_v": voltage_v}}}
+
+
+class IngestTestCase(TestCase):
+    """写回缓冲改为每次直接落库，读写都在测试事务内完成，不启动后台线程"""
+
+    def setUp(self):
+        for flusher in (meter_states, usage_accumulator, raw_readings):
+            patcher = mock.patch.object(flusher, "interval", 0)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(recent_readings.discard, "m1")
+        self.addCleanup(recent_readings.discard, "m2")
+
+    def ingest(self, readings):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ingest_readings(readings)
+
+    def hourly_kwh(self, meter_id):
+        return sum(HourlyUsage.objects.filter(meter__meter_id=meter_id).values_list("kwh", flat=True))
+
+
+class ParseReadingTests(TestCase):
+    def test_rejects_bad_ts(self):
+        for ts in ("nan", float("inf"), 1e20, -1, time.time() + 3600):
+            with self.subTest(ts=ts), self.assertRaises(ValueError):
+                parse_reading(reading("m1", ts))
+
+    def test_rejects_non_finite_power(self):
+        with self.assertRaises(ValueError):
+            parse_reading(reading("m1", None, power_w="inf"))
+
+    def test_accepts_missing_ts(self):
+        self.assertEqual(parse_reading(reading("m1", None))[2], None)
+
+
+class IngestBatchTests(IngestTestCase):
+    def test_bad_ts_only_rejects_that_item(self):
+        now = time.time()
+        results, _ = self.ingest([
+            reading("m1", now - 120),
+            reading("m1", "nan"),
+            reading("m1", 1e20),
+            reading("m1", now - 60),
+        ])
+
+        self.assertEqual([r["ok"] for r in results], [True, False, False, True])
+        # 60 秒 × 1000 W
+        self.assertAlmostEqual(self.hourly_kwh("m1"), 1000 / 1000 * 60 / 3600)
+
+    def test_failed_batch_leaves_no_side_effects(self):
+        now = time.time()
+        self.ingest([reading("m1", now - 120)])
+
+        with mock.patch.object(alert_engine, "process", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self.ingest([reading("m1", now - 60), reading("m2", now - 60)])
+
+        self.assertEqual(self.hourly_kwh("m1"), 0)
+        self.assertEqual(recent_readings.series("m1")["ts"], [round(now - 120, 3)])
+        self.assertEqual(recent_readings.series("m2")["ts"], [])
+        self.assertFalse(Meter.objects.filter(meter_id="m2").exists())
+
+        # 网关重试同一批：电量只计一次
+        self.ingest([reading("m1", now - 60), reading("m2", now - 60)])
+        self.assertAlmostEqual(self.hourly_kwh("m1"), 60 / 3600)
+
+    def test_out_of_order_reading_is_ignored(self):
+        now = time.time()
+        self.ingest([reading("m1", now - 120), reading("m1", now - 60)])
+        meter = Meter.objects.get(meter_id="m1")
+        energy_today = meter.energy_today
+
+        # 上一批迟到的读数（甚至是昨天的）不计电量，也不清零当日累计
+        results, _ = self.ingest([reading("m1", now - 90), reading("m1", now - 86400)])
+        self.assertEqual([r["ok"] for r in results], [True, True])
+        meter.refresh_from_db()
+        self.assertAlmostEqual(meter.energy_today, energy_today)
+        self.assertAlmostEqual(meter.last_ts, now - 60, places=2)
+        self.assertAlmostEqual(self.hourly_kwh("m1"), 60 / 3600)
+
+    def test_recent_readings_report_process_scope(self):
+        now = time.time()
+        self.ingest([reading("m1", now - 2), reading("m1", now - 1, power_w=500)])
+
+        data = self.client.get("/monitor/realtime/recent/", {"meter_id": "m1"}).json()
+        self.assertEqual(data["scope"], "process")
+        self.assertEqual(data["pid"], os.getpid())
+        self.assertEqual(data["power_w"], [1000, 500])
+
+
+class MeterStateTests(IngestTestCase):
+    def test_collect_uses_database_state(self):
+        self.addCleanup(meter_registry.clear)
+        Meter.objects.create(meter_id="m1", last_ts=time.time() - 3600, last_power_w=1000)
+        meter_registry.get("m1")
+
+        # 另一个进程已处理到 1 秒前，本进程注册表里缓存的还是 1 小时前的状态
+        Meter.objects.filter(meter_id="m1").update(last_ts=time.time() - 1, energy_today=5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/monitor/realtime/collect/",
+                {"meter_id": "m1", "data": {"_TOTAL": {"power_w": 1000, "voltage_v": 220}}},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        meter = Meter.objects.get(meter_id="m1")
+        self.assertGreater(meter.energy_today, 5)
+        self.assertLess(meter.energy_today, 5.01)
+        self.assertLess(self.hourly_kwh("m1"), 0.01)
+
+    def test_collect_failure_leaves_no_side_effects(self):
+        Meter.objects.create(meter_id="m1", last_ts=time.time() - 60, last_power_w=1000)
+        body = {"meter_id": "m1", "data": {"_TOTAL": {"power_w": 1000, "voltage_v": 220}}}
+
+        with mock.patch.object(meter_states, "save", side_effect=RuntimeError("boom")):
+            with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+                self.client.post("/monitor/realtime/collect/", body, content_type="application/json")
+
+        self.assertEqual(recent_readings.series("m1")["ts"], [])
+        self.assertFalse(RealtimeUsage.objects.exists())
+        self.assertEqual(self.hourly_kwh("m1"), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/monitor/realtime/collect/", body, content_type="application/json")
+        self.assertEqual(len(recent_readings.series("m1")["ts"]), 1)
+        self.assertAlmostEqual(self.hourly_kwh("m1"), 60 / 3600, places=4)
+
+
+class RegistryTests(TestCase):
+    def setUp(self):
+        self.addCleanup(meter_registry.clear)
+        self.meter = Meter.objects.create(meter_id="rg")
+        self.user = User.objects.create_user(email="rg@example.com")
+
+    def test_caches_until_changed(self):
+        self.assertIsNone(meter_registry.get("rg").user_id)
+        # 其他进程绑定了用户
+        Meter.objects.filter(pk=self.meter.pk).update(user=self.user)
+        self.assertIsNone(meter_registry.get("rg").user_id)
+
+        meter_registry._on_message(json.dumps({"meter_id": "rg", "pk": self.meter.pk, "deleted": False}))
+        self.assertEqual(meter_registry.get("rg").user_id, self.user.pk)
+
+    def test_expires_after_ttl(self):
+        meter_registry.get("rg")
+        Meter.objects.filter(pk=self.meter.pk).update(user=self.user)
+        with mock.patch.object(meter_registry, "ttl", 0):
+            self.assertEqual(meter_registry.get("rg").user_id, self.user.pk)
+
+    def test_publishes_after_commit(self):
+        with mock.patch.object(meter_registry, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.meter.user = self.user
+                self.meter.save()
+                # 写穿的热状态不失效、不广播
+                meter_states.save(self.meter)
+                publish.assert_not_called()
+        publish.assert_called_once_with("rg", self.meter.pk)
+
+    def test_remote_delete_discards_buffers(self):
+        with mock.patch.object(usage_accumulator, "ensure_started"):
+            usage_accumulator.add(self.meter.pk, date.today(), 1, 1.0)
+        meter_registry._on_message(json.dumps({"meter_id": "rg", "pk": self.meter.pk, "deleted": True}))
+        self.assertEqual(usage_accumulator.flush(), 0)
+
+
+class FlusherTests(TransactionTestCase):
+    # 在自动提交模式下执行，SQLite 的外键检查在 _write 的事务提交时触发，与生产库一样报 IntegrityError
+
+    def setUp(self):
+        self.meter = Meter.objects.create(meter_id="fl")
+        self.day = date.today()
+        for flusher in (usage_accumulator, raw_readings):
+            patcher = mock.patch.object(flusher, "ensure_started")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            self.addCleanup(flusher.flush)
+
+    def test_accumulator_flush_merges_deltas(self):
+        usage_accumulator.add(self.meter.pk, self.day, 3, 1.0)
+        usage_accumulator.add(self.meter.pk, self.day, 3, 0.5)
+        self.assertEqual(usage_accumulator.flush(), 1)
+        self.assertEqual(HourlyUsage.objects.get(meter=self.meter, day=self.day, hour=3).kwh, 1.5)
+        self.assertEqual(usage_accumulator.flush(), 0)
+
+    def test_accumulator_restores_on_transient_error(self):
+        usage_accumulator.add(self.meter.pk, self.day, 3, 1.0)
+        with mock.patch("power.utils.bulk_increment", side_effect=OperationalError("gone away")):
+            with self.assertRaises(OperationalError):
+                usage_accumulator.flush()
+        self.assertFalse(HourlyUsage.objects.exists())
+
+        usage_accumulator.add(self.meter.pk, self.day, 3, 0.5)
+        usage_accumulator.flush()
+        self.assertEqual(HourlyUsage.objects.get(meter=self.meter, day=self.day, hour=3).kwh, 1.5)
+
+    def test_accumulator_drops_deleted_meter(self):
+        gone = Meter.objects.create(meter_id="gone")
+        gone_pk = gone.pk
+        Meter.objects.filter(pk=gone_pk).delete()
+
+        usage_accumulator.add(self.meter.pk, self.day, 3, 1.0)
+        usage_accumulator.add(gone_pk, self.day, 3, 2.0)
+        self.assertEqual(usage_accumulator.flush(), 1)
+
+        self.assertEqual(list(HourlyUsage.objects.values_list("meter_id", "kwh")), [(self.meter.pk, 1.0)])
+        # 无效数据已丢弃，不会留在缓冲里让之后每次 flush 都失败
+        self.assertEqual(usage_accumulator.flush(), 0)
+
+    def test_raw_readings_drop_deleted_meter(self):
+        self.addCleanup(raw_readings.discard, self.meter.pk)
+        gone = Meter.objects.create(meter_id="gone")
+        gone_pk = gone.pk
+        Meter.objects.filter(pk=gone_pk).delete()
+
+        now = time.time()
+        with mock.patch.object(raw_readings, "sample_every", 1):
+            raw_readings.add(self.meter, now, 1000)
+            raw_readings.add(Meter(pk=gone_pk), now, 1000)
+        self.assertEqual(raw_readings.flush(), 1)
+        self.assertEqual(list(RealtimeUsage.objects.values_list("meter_id", flat=True)), [self.meter.pk])
+        self.assertEqual(raw_readings.flush(), 0)
+
+
+class EncodingTests(TestCase):
+    def frame_data(self, **devices):
+        return {"devices": {"_TOTAL": {"power_w": 100, "energy_kwh_total": 123456.789}, **devices}}
+
+    def test_delta_frames(self):
+        encoder = DeltaFrameEncoder(3)
+        frames = [
+            encoder.encode("m1", self.frame_data(a={"power_w": 1, "on": True}, b={"power_w": 2})),
+            encoder.encode("m1", self.frame_data(a={"power_w": 1, "on": True}, b={"power_w": 5})),
+            encoder.encode("m1", self.frame_data(a={"power_w": 1, "on": True})),
+            encoder.encode("m1", self.frame_data(a={"power_w": 1, "on": True})),
+        ]
+        self.assertEqual([f["k"] for f in frames], [1, 0, 0, 1])
+        self.assertEqual(frames[1]["d"], {"b": [5, 0]})
+        self.assertEqual(frames[2]["x"], ["b"])
+        self.assertEqual(frames[3]["d"], {"a": [1, 1]})
+
+    def test_zero_interval_sends_keyframes(self):
+        encoder = DeltaFrameEncoder(0)
+        frames = [encoder.encode("m1", self.frame_data()) for _ in range(3)]
+        self.assertEqual([f["k"] for f in frames], [1, 1, 1])
+
+    def test_pack_keeps_energy_precision(self):
+        if msgpack is None:
+            self.skipTest("msgpack 未安装")
+        frame = DeltaFrameEncoder().encode("m1", self.frame_data())
+        unpacked = msgpack.unpackb(pack(frame))
+        self.assertEqual(unpacked["e"], 123456.789)
+        self.assertAlmostEqual(unpacked["p"], 100)
+
+
+class MultiMeterConsumerTests(TestCase):
+    async def test_rejects_malformed_messages(self):
+        communicator = WebsocketCommunicator(MultiMeterConsumer.as_asgi(), "/ws/monitor/meters/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        for message in (["subscribe"], "subscribe", 1, {"action": "subscribe", "meter_ids": "M1"}):
+            await communicator.send_json_to(message)
+            self.assertEqual((await communicator.receive_json_from())["type"], "error")
+
+        # 连接仍然可用
+        await communicator.send_json_to({"action": "unsubscribe_all"})
+        self.assertEqual(await communicator.receive_json_from(), {"type": "subscribed", "meter_ids": []})
+        await communicator.disconnect()
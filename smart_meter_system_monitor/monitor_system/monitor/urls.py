@@ -1,6 +1,11 @@
 from django.urls import path
-from .views import RealtimeCollectView
+from .views import RealtimeCollectView, RealtimeBatchCollectView, realtime_collect_async, \
+    CacheStatsView, RecentReadingsView
 
 urlpatterns = [
     path("realtime/collect/", RealtimeCollectView.as_view()),
+    path("realtime/collect/batch/", RealtimeBatchCollectView.as_view()),
+    path("realtime/collect/async/", realtime_collect_async),
+    path("realtime/recent/", RecentReadingsView.as_view()),
+    path("cache/stats/", CacheStatsView.as_view()),
 ]
@@ -1,56 +1,48 @@
 import re
-from power.models import RealtimeAlert
+import time
+import asyncio
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from monitor.consumers import make_group_name
+from monitor.alerts import alert_engine
+from monitor.coalescer import realtime_coalescer
 
 def make_group_name(meter_id: str) -> str:
     safe = re.sub(r"[^A-Za-z0-9_.-]", "_", str(meter_id))[:80]
     return f"meter_{safe}"
 
-def detect_realtime_alerts(meter, total_power_w, voltage_v, last_power=None):
-    alerts = []
 
-    # 功率过高
-    if total_power_w > 8000:
-        alerts.append(("high_power", f"功率过高：{total_power_w:.2f} W"))
+async def asend_group_messages(messages):
+    """并发推送多条 (group, message)，不经过合并"""
+    if not messages:
+        return
 
-    # 用电突增
-    if last_power and last_power > 1000:
-        if (total_power_w - last_power) / last_power > 1:
-            alerts.append(("sudden_usage", f"用电突增：{last_power:.2f} → {total_power_w:.2f} W"))
+    layer = get_channel_layer()
+    await asyncio.gather(*[
+        layer.group_send(group, message) for group, message in messages
+    ])
 
-    # 电压异常
-    if voltage_v < 200 or voltage_v > 250:
-        alerts.append(("voltage_issue", f"电压异常：{voltage_v:.2f} V"))
 
-    # 波动异常
-    if last_power:
-        if abs(total_power_w - last_power) > 2000:
-            alerts.append(("fluctuation", f"功率波动异常：差值 {abs(total_power_w - last_power):.2f} W"))
+def send_group_messages(messages):
+    """同步代码中使用：一次 async_to_sync 推送全部消息"""
+    if messages:
+        async_to_sync(asend_group_messages)(messages)
 
-    # 写入数据库 + 推送 WebSocket
-    layer = get_channel_layer()
-    group = make_group_name(meter.meter_id)
-
-    for t, desc in alerts:
-        RealtimeAlert.objects.create(
-            meter=meter,
-            type=t,
-            desc=desc
-        )
-
-        # 推送 WebSocket
-        async_to_sync(layer.group_send)(
-            group,
-            {
-                "type": "alert_message",  # Consumer 中需要实现
-                "alert": {
-                    "type": t,
-                    "desc": desc,
-                    "meter_id": meter.meter_id,
-                }
-            }
-        )
-
-    return alerts
+
+async def apush_group_messages(messages):
+    """实时帧交给 realtime_coalescer 限频合并，其余消息立即推送"""
+    await asend_group_messages(realtime_coalescer.absorb(messages))
+
+
+def push_group_messages(messages):
+    send_group_messages(realtime_coalescer.absorb(messages))
+
+
+def detect_realtime_alerts(meter, total_power_w, voltage_v, last_power=None):
+    """单条读数的告警判断 + 写库 + 推送，规则见 monitor.alerts"""
+    found, messages = alert_engine.process(
+        [(meter, total_power_w, voltage_v, last_power, time.time())]
+    )
+    push_group_messages(messages)
+
+    return [(t, desc) for _, t, desc in found]
@@ -1,18 +1,37 @@
-from power.models import Meter, DailyUsage, MonthlyUsage, HourlyUsage
-from datetime import datetime, date
-from django.db import models
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .consumers import process_meter_update, make_group_name, record_usage
 import json
+import os
+import time
+from functools import partial
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from power.models import Meter
 from monitor.consumers import process_meter_update, record_usage, make_group_name
-from monitor.utils import detect_realtime_alerts
+from monitor.utils import detect_realtime_alerts, push_group_messages, apush_group_messages
+from monitor.ingest import ingest_readings, aingest_readings, realtime_message
+from monitor.registry import meter_registry
+from monitor.ringbuffer import recent_readings
+from monitor.rawlog import raw_readings
+from system.utils import option_cache
+from power.cache import trend_cache
+from rest_framework.permissions import IsAdminUser
+from django.conf import settings
+from django.db import transaction
+from monitor.state import meter_states
+
+def defer_reading_effects(meter, now_ts, power_w, voltage_v, added):
+    """
+    单条读数的内存缓冲、原始读数和小时增量登记到事务提交后执行（与 monitor.ingest 一致），
+    电表状态更新失败回滚时不留下副作用
+    """
+    transaction.on_commit(
+        partial(recent_readings.record, meter.meter_id, now_ts, power_w, voltage_v), robust=True,
+    )
+    transaction.on_commit(partial(raw_readings.add, meter, now_ts, power_w), robust=True)
+    if added > 0:
+        transaction.on_commit(partial(record_usage, meter, added, now_ts=now_ts), robust=True)
+
 
 @csrf_exempt
 def realtime_collect(request):
@@ -29,25 +48,21 @@ def realtime_collect(request):
             return JsonResponse({"error": "missing fields"}, status=400)
 
         # 获取电表
-        meter, _ = Meter.objects.get_or_create(meter_id=meter_id)
+        meter, _ = meter_registry.get_or_create(meter_id)
 
         power_w = float(total.get("power_w", 0))
+        now_ts = time.time()
 
-        # 写入能耗模型
-        added = process_meter_update(meter, power_w)
-        if added > 0:
-            record_usage(meter, added)
+        # 写入能耗模型（锁定电表行，以数据库中的最新状态计算增量），其余副作用在事务提交后执行
+        with transaction.atomic():
+            added = process_meter_update(meter_states.lock(meter), power_w, now_ts=now_ts)
+            defer_reading_effects(meter, now_ts, power_w, float(total.get("voltage_v", 0)), added)
 
         group_name = make_group_name(meter_id)
-        channel_layer = get_channel_layer()
-
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                "type": "realtime_update",
-                "data": body
-            }
-        )
+        push_group_messages([(group_name, {
+            "type": "realtime_update",
+            "data": body
+        })])
 
         return JsonResponse({"ok": True})
 
@@ -55,6 +70,53 @@ def realtime_collect(request):
         print("collect error:", e)
         return JsonResponse({"error": str(e)}, status=500)
 
+@csrf_exempt
+async def realtime_collect_async(request):
+    """
+    原生异步上报入口（ASGI）。
+    body 可以是单条读数，也可以是 {"readings": [...]} 批量读数；
+    DB 操作在线程池中执行，WebSocket 推送并发 await。
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    try:
+        body = json.loads(request.body.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return JsonResponse({"error": "invalid json"}, status=400)
+
+    single = isinstance(body, dict) and "readings" not in body
+    readings = [body] if single else (body.get("readings") if isinstance(body, dict) else body)
+
+    if not isinstance(readings, list) or not readings:
+        return JsonResponse({"error": "readings must be a non-empty list"}, status=400)
+
+    max_size = getattr(settings, "INGEST_BATCH_MAX", 1000)
+    if len(readings) > max_size:
+        return JsonResponse({"error": f"too many readings (max {max_size})"}, status=413)
+
+    try:
+        results, messages = await aingest_readings(readings)
+        await apush_group_messages(messages)
+    except Exception as e:
+        print("async collect error:", e)
+        return JsonResponse({"error": str(e)}, status=500)
+
+    if single:
+        result = results[0]
+        if not result["ok"]:
+            return JsonResponse({"error": result["error"]}, status=400)
+        return JsonResponse({"ok": True})
+
+    accepted = sum(1 for r in results if r["ok"])
+    return JsonResponse({
+        "ok": True,
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results,
+    })
+
+
 class RealtimeCollectView(APIView):
     permission_classes = [AllowAny]
 
@@ -70,9 +132,13 @@ class RealtimeCollectView(APIView):
         voltage_v = float(total.get("voltage_v", 0))
 
         # 获取电表
-        meter, _ = Meter.objects.get_or_create(meter_id=meter_id)
-        last_power = meter.last_power_w
-        added = process_meter_update(meter, power_w)
+        meter, _ = meter_registry.get_or_create(meter_id)
+        now_ts = time.time()
+        with transaction.atomic():
+            meter = meter_states.lock(meter)
+            last_power = meter.last_power_w
+            added = process_meter_update(meter, power_w, now_ts=now_ts)
+            defer_reading_effects(meter, now_ts, power_w, voltage_v, added)
         detect_realtime_alerts(
             meter=meter,
             total_power_w=power_w,
@@ -80,24 +146,75 @@ class RealtimeCollectView(APIView):
             last_power=last_power
         )
 
-        if added > 0:
-            record_usage(meter, added)
-
-        layer = get_channel_layer()
-        async_to_sync(layer.group_send)(
-            make_group_name(meter_id),
-            {
-                "type": "realtime.update",
-                "data": {
-                    "meter_id": meter_id,
-                    "power_w": power_w,
-                    "voltage_v": voltage_v,
-                    "current_a": total.get("current_a", 0),
-                    "devices": payload
-                }
-            }
-        )
+        # 实时帧经 realtime_coalescer 限频后推送
+        push_group_messages([(make_group_name(meter_id), realtime_message(meter_id, payload))])
 
         return Response({"ok": True})
 
 
+class RealtimeBatchCollectView(APIView):
+    """
+    网关批量上报：一次提交多块电表的多条读数
+    body: {"readings": [{"meter_id": ..., "data": {..., "_TOTAL": {...}}, "ts": 可选}, ...]}
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        readings = request.data
+        if isinstance(readings, dict):
+            readings = readings.get("readings")
+
+        if not isinstance(readings, list) or not readings:
+            return Response({"error": "readings must be a non-empty list"}, status=400)
+
+        max_size = getattr(settings, "INGEST_BATCH_MAX", 1000)
+        if len(readings) > max_size:
+            return Response({"error": f"too many readings (max {max_size})"}, status=413)
+
+        results, messages = ingest_readings(readings)
+        push_group_messages(messages)
+
+        accepted = sum(1 for r in results if r["ok"])
+        return Response({
+            "ok": True,
+            "accepted": accepted,
+            "rejected": len(results) - accepted,
+            "results": results,
+        })
+
+
+class RecentReadingsView(APIView):
+    """
+    最近一段时间的实时读数，直接读内存环形缓冲，不查数据库。
+    缓冲是进程内的（见 monitor.ringbuffer.RecentReadings），只包含经处理本请求的进程（pid）上报的读数，
+    响应中 scope = "process" 明确这一限制
+    """
+
+    def get(self, request):
+        meter_id = request.GET.get("meter_id")
+        if not meter_id:
+            return Response({"error": "meter_id missing"}, status=400)
+
+        try:
+            seconds = float(request.GET.get("seconds", 0)) or None
+        except ValueError:
+            return Response({"error": "invalid seconds"}, status=400)
+
+        return Response({
+            "meter_id": meter_id,
+            "scope": "process",
+            "pid": os.getpid(),
+            **recent_readings.series(meter_id, seconds)
+        })
+
+
+class CacheStatsView(APIView):
+    """进程内缓存命中统计（运维排查用）"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "meter_registry": meter_registry.stats(),
+            "system_options": option_cache.stats(),
+            "trend": trend_cache.stats(),
+        })
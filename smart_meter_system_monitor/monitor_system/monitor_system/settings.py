@@ -115,16 +115,76 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = 'user.User'
 
+REDIS_URL = "redis://localhost:6379/0"
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("localhost", 6379)],
+            "hosts": [REDIS_URL],
         },
     },
 }
 
+# 趋势接口等响应缓存，多进程共享
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    },
+}
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),  # 可改成 2 小时
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),     # 长期保持登录
-}
\ No newline at end of file
+}
+
+# 批量上报单次最多读数条数
+INGEST_BATCH_MAX = 1000
+# 异步上报入口的入库线程池大小
+INGEST_DB_WORKERS = 8
+# 上报读数时间戳最多允许超前服务器时间的秒数，超出的读数单条拒绝
+INGEST_MAX_CLOCK_SKEW = 300
+# 电表热状态写回间隔（秒），0 表示每条读数直接写库（多进程部署必须为 0，见 monitor.state）
+METER_STATE_FLUSH_INTERVAL = 0
+# HourlyUsage 增量合并写入间隔（秒），0 表示每条读数直接 upsert
+USAGE_FLUSH_INTERVAL = 5
+# 电表注册表（meter_id -> Meter）LRU 容量
+METER_REGISTRY_SIZE = 10000
+# 电表注册表本地缓存过期时间（秒），Redis 通知失效时的兜底
+METER_REGISTRY_TTL = 300
+# SystemOption 本地缓存过期时间（秒），Redis 通知失效时的兜底
+OPTION_CACHE_TTL = 60
+# 每块电表实时帧最大推送频率（帧/秒），0 表示不合并
+REALTIME_PUSH_MAX_RATE = 4
+# 多电表 WebSocket 单连接最多订阅数
+WS_MAX_SUBSCRIPTIONS = 500
+# 压缩协议下每块电表的关键帧间隔（帧），0 或 1 表示每帧都是关键帧
+WS_KEYFRAME_INTERVAL = 30
+# 每块电表在内存中保留的最近读数条数（1Hz 下 600 条 = 10 分钟）；进程内缓冲，多进程部署时各进程只有自己收到的读数
+RECENT_READINGS_SIZE = 600
+# WebSocket 连接时下发的历史读数时长（秒），0 表示不下发
+WS_BACKLOG_SECONDS = 600
+# 原始读数落盘（monitor.RealtimeUsage）：每 N 条采样 1 条（0 关闭）、最长延迟（秒）、批大小、缓冲上限
+RAW_READING_SAMPLE_EVERY = 1
+RAW_READING_FLUSH_INTERVAL = 2
+RAW_READING_BATCH_SIZE = 1000
+RAW_READING_MAX_BUFFER = 100000
+# 趋势接口缓存：包含今天的周期（当前周期）的缓存过期时间（秒），历史周期不过期
+TREND_CACHE_TTL = 300
+# 已由 close_day 结算的周期（历史日/周/月）的 HTTP Cache-Control max-age（秒）；
+# rebuild_usage / generate_bills 改写历史数据后，浏览器最多在这段时间内看到旧数据
+HTTP_CLOSED_PERIOD_MAX_AGE = 3600
+# 多电表趋势对比单次最多电表数
+TREND_COMPARE_MAX_METERS = 1000
+# 任意范围趋势：自动选择粒度时原始点数上限（超过则换更粗的粒度）
+TREND_RANGE_MAX_RAW_POINTS = 10000
+# 报告生成：后台进程数（0 表示在请求内同步生成）、不超过该月数的报告同步生成、任务文件目录、超时与保留时间（秒）
+REPORT_WORKERS = 2
+REPORT_SYNC_MAX_MONTHS = 1
+REPORT_JOB_DIR = BASE_DIR / "var" / "report_jobs"
+REPORT_JOB_TIMEOUT = 300
+REPORT_JOB_TTL = 86400
+# 报告渲染结果（PDF / 趋势图）磁盘缓存目录与总大小上限（字节），超出后按最近使用时间淘汰
+REPORT_CACHE_DIR = BASE_DIR / "var" / "report_cache"
+REPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
@@ -0,0 +1,220 @@
+"""
+趋势分析（日 / 周 / 月）。
+
+先把多块电表 × 多个时间点的用电量一次性读成 (电表数, 时间点数) 的矩阵，
+再用 numpy 按行统计，单表趋势和多表对比共用同一套计算。
+每个 trend_* 返回 (x, rows)，rows 与传入的 meter_pks 一一对应：{"y": [...], "analysis": {...}}
+"""
+import calendar
+from datetime import date, timedelta
+import numpy as np
+from .models import DailyUsage, HourlyUsage, MonthlyUsage
+
+
+def usage_matrix(meter_pks, rows, columns):
+    """rows: [(meter_pk, 列 key, kwh), ...] → (len(meter_pks), len(columns)) 矩阵，缺失为 0"""
+    row_index = {pk: i for i, pk in enumerate(meter_pks)}
+    col_index = {c: j for j, c in enumerate(columns)}
+
+    ri, ci, values = [], [], []
+    for pk, key, kwh in rows:
+        j = col_index.get(key)
+        if j is None:
+            continue
+        ri.append(row_index[pk])
+        ci.append(j)
+        # 与原接口一致：先按 4 位小数取整再统计
+        values.append(round(kwh, 4))
+
+    matrix = np.zeros((len(meter_pks), len(columns)))
+    np.add.at(matrix, (ri, ci), values)
+    return matrix
+
+
+def hourly_matrix(meter_pks, day):
+    rows = HourlyUsage.objects.filter(meter_id__in=meter_pks, day=day).values_list("meter_id", "hour", "kwh")
+    return usage_matrix(meter_pks, rows, range(24))
+
+
+def daily_matrix(meter_pks, days):
+    rows = DailyUsage.objects.filter(
+        meter_id__in=meter_pks, day__range=(days[0], days[-1])
+    ).values_list("meter_id", "day", "kwh")
+    return usage_matrix(meter_pks, rows, days)
+
+
+def _ratio(a, b):
+    """a / b，b 为 0 时结果为 0"""
+    return np.divide(a, b, out=np.zeros_like(a, dtype=float), where=b != 0)
+
+
+def _r(a):
+    # 用 Python round 输出（np.round 在 .5 边界上与之不同，会改变接口返回值）
+    return [round(v, 4) for v in np.asarray(a).tolist()]
+
+
+def _pick(x, idx):
+    return [x[i] for i in idx.tolist()]
+
+
+def trend_day(meter_pks, day):
+    """24 小时趋势：总量、均值、峰谷时段、夜间（0~6 点）占比"""
+    x = [f"{h:02d}:00" for h in range(24)]
+    y = hourly_matrix(meter_pks, day)
+
+    total = y.sum(axis=1)
+    peak = y.argmax(axis=1)
+    valley = y.argmin(axis=1)
+    rows_idx = np.arange(len(meter_pks))
+
+    analysis = {
+        "total_kwh": _r(total),
+        "avg_kwh": _r(total / 24),
+        "peak_hour": _pick(x, peak),
+        "peak_kwh": _r(y[rows_idx, peak]),
+        "valley_hour": _pick(x, valley),
+        "night_ratio": _r(_ratio(y[:, :6].sum(axis=1), total)),
+    }
+    return x, _rows(y, analysis)
+
+
+def trend_week(meter_pks, end_day):
+    """截至 end_day 的 7 天趋势：总量、日均、最高/最低日、波动、工作日/周末日均"""
+    days = [end_day - timedelta(days=6 - i) for i in range(7)]
+    x = [d.strftime("%Y-%m-%d") for d in days]
+    y = daily_matrix(meter_pks, days)
+
+    total = np.array(_r(y.sum(axis=1)))
+    hi, lo = y.argmax(axis=1), y.argmin(axis=1)
+    rows_idx = np.arange(len(meter_pks))
+    workday = np.array([d.weekday() < 5 for d in days])
+
+    analysis = {
+        "total_kwh": _r(total),
+        "avg_daily_kwh": _r(total / 7),
+        "max_day": _pick(x, hi),
+        "max_kwh": _r(y[rows_idx, hi]),
+        "min_day": _pick(x, lo),
+        "min_kwh": _r(y[rows_idx, lo]),
+        "fluctuation": _r(y[rows_idx, hi] - y[rows_idx, lo]),
+        "workday_avg": _r(y[:, workday].mean(axis=1)),
+        "weekend_avg": _r(y[:, ~workday].mean(axis=1)),
+    }
+    return x, _rows(y, analysis)
+
+
+def trend_month(meter_pks, year, month):
+    """整月趋势：总量、日均、最高/最低日、用电最多的 3 天、上下半月对比"""
+    days_in_month = calendar.monthrange(year, month)[1]
+    days = [date(year, month, d) for d in range(1, days_in_month + 1)]
+    x = [d.strftime("%Y-%m-%d") for d in days]
+    y = daily_matrix(meter_pks, days)
+
+    total = np.array(_r(y.sum(axis=1)))
+    hi, lo = y.argmax(axis=1), y.argmin(axis=1)
+    rows_idx = np.arange(len(meter_pks))
+    # 稳定排序：用电量相同时日期靠前的在前
+    top3 = np.argsort(-y, axis=1, kind="stable")[:, :3]
+
+    mid = days_in_month // 2
+    first_half = np.array(_r(y[:, :mid].sum(axis=1)))
+    second_half = np.array(_r(y[:, mid:].sum(axis=1)))
+
+    analysis = {
+        "total_kwh": _r(total),
+        "avg_daily_kwh": _r(total / days_in_month),
+        "max_day": _pick(x, hi),
+        "max_kwh": _r(y[rows_idx, hi]),
+        "min_day": _pick(x, lo),
+        "min_kwh": _r(y[rows_idx, lo]),
+        "top3_days": [
+            [{"day": x[i], "kwh": kwh} for i, kwh in zip(idx, _r(y[r, idx]))]
+            for r, idx in enumerate(top3.tolist())
+        ],
+        "first_half_kwh": _r(first_half),
+        "second_half_kwh": _r(second_half),
+        "half_compare": _r(second_half - first_half),
+    }
+    return x, _rows(y, analysis)
+
+
+def _rows(y, analysis):
+    """按列存放的统计结果拆回每块电表一行"""
+    keys = list(analysis)
+    return [
+        {"y": y_row, "analysis": dict(zip(keys, values))}
+        for y_row, *values in zip(y.tolist(), *(analysis[k] for k in keys))
+    ]
+
+
+RESOLUTIONS = ("hour", "day", "month")
+
+
+def pick_resolution(start, end, max_raw_points):
+    """选择点数不超过 max_raw_points 的最细粒度（小时 → 天 → 月）"""
+    days = (end - start).days + 1
+    if days * 24 <= max_raw_points:
+        return "hour"
+    if days <= max_raw_points:
+        return "day"
+    return "month"
+
+
+def range_series(meter_pk, start, end, resolution):
+    """[start, end] 内按 resolution 的完整序列（缺失补 0），返回 (x, y 数组)"""
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+    if resolution == "hour":
+        columns = [(d, h) for d in days for h in range(24)]
+        rows = (
+            (pk, (d, h), kwh) for pk, d, h, kwh in HourlyUsage.objects.filter(
+                meter_id=meter_pk, day__range=(start, end)
+            ).values_list("meter_id", "day", "hour", "kwh")
+        )
+        x = [f"{d:%Y-%m-%d} {h:02d}:00" for d, h in columns]
+    elif resolution == "day":
+        columns = days
+        rows = DailyUsage.objects.filter(
+            meter_id=meter_pk, day__range=(start, end)
+        ).values_list("meter_id", "day", "kwh")
+        x = [f"{d:%Y-%m-%d}" for d in columns]
+    else:
+        columns = list(dict.fromkeys((d.year, d.month) for d in days))
+        rows = (
+            (pk, (year, month), kwh) for pk, year, month, kwh in MonthlyUsage.objects.filter(
+                meter_id=meter_pk, year__gte=start.year, year__lte=end.year
+            ).values_list("meter_id", "year", "month", "kwh")
+        )
+        x = [f"{year}-{month:02d}" for year, month in columns]
+
+    return x, usage_matrix([meter_pk], rows, columns)[0]
+
+
+def lttb(y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留点的下标（含首尾）。
+    序列等间隔，横坐标直接用下标；每个桶内选与前一个已选点、下一桶均值构成三角形面积最大的点，
+    峰谷形状得以保留。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)   # 中间 threshold - 2 个桶
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一个桶的均值（最后一个桶取末点）
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
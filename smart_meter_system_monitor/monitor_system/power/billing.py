@@ -0,0 +1,137 @@
+"""
+电费计算：按 HourlyUsage 计算月度账单并写入 Bill。
+
+一批电表一个月的小时数据先在数据库端按 (电表, 小时) 汇总，读成 (电表数, 24) 的矩阵，
+峰谷分时电费是矩阵与 24 小时电价向量的乘积，阶梯加价按月用电量分档，整批一次算完、一次写入。
+close_day 每天结算当月账单，rebuild_usage 重算后同步更新，调整电价后用 generate_bills 重算。
+"""
+import calendar
+import hashlib
+import threading
+from datetime import date
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from system.utils import option_cache, get_float_option, get_option
+from .models import Bill, HourlyUsage
+from .utils import bulk_upsert
+
+
+class Tariff:
+    """
+    从 SystemOption 编译出的电价（括号内为默认值，默认即全时段 0.65 元/kWh、不分档）：
+        bill_peak_price        峰时（非谷时段）电价 元/kWh（0.65）
+        bill_valley_price      谷时电价 元/kWh（0.65）
+        bill_valley_hours      谷时段 "起-止" 小时，如 "22-8" 表示 22:00~次日 8:00（22-8）
+        bill_tier_kwh          阶梯分档月用电量 kWh，逗号分隔，如 "200,400"（不分档）
+        bill_tier_surcharge    各档相对峰谷电价的加价 元/kWh，与分档一一对应，如 "0.05,0.3"（不分档）
+
+    阶梯加价按档独立计算、不累加：上例中月用电 500 kWh 时，
+    0~200 kWh 不加价，200~400 kWh 每 kWh 加 0.05，400 kWh 以上每 kWh 加 0.3（不是 0.35）。
+    """
+
+    def __init__(self):
+        peak = get_float_option("bill_peak_price", 0.65)
+        valley = get_float_option("bill_valley_price", 0.65)
+        self.hour_prices = np.where(_valley_mask(get_option("bill_valley_hours", "22-8")), valley, peak)
+
+        tiers = _float_list(get_option("bill_tier_kwh", ""))
+        surcharges = _float_list(get_option("bill_tier_surcharge", ""))
+        if len(tiers) != len(surcharges) or tiers != sorted(tiers):
+            tiers, surcharges = [], []
+        self.tiers = np.array(tiers, dtype=float)
+        self.surcharges = np.array(surcharges, dtype=float)
+        # 电价参数摘要：各进程对同一组配置得到相同的值，按当前电价估算的响应用它参与 ETag
+        self.digest = hashlib.sha1(
+            repr((self.hour_prices.tolist(), tiers, surcharges)).encode()
+        ).hexdigest()[:12]
+
+    def fees(self, hourly):
+        """hourly: (电表数, 24) 每小时用电量（整月合计）→ 每块电表的电费"""
+        return hourly @ self.hour_prices + self.tier_fees(hourly.sum(axis=1))
+
+    def tier_fees(self, total_kwh):
+        """阶梯加价：落在第 i 档（tiers[i] 到 tiers[i+1]）内的用电量每 kWh 加 surcharges[i]"""
+        over = np.clip(np.asarray(total_kwh, dtype=float)[..., None] - self.tiers, 0, None)
+        # 超过第 i 档的电量再加价 surcharges[i] - surcharges[i-1]，叠加后每档恰为该档加价
+        return over @ np.diff(self.surcharges, prepend=0)
+
+    def estimate(self, total_kwh):
+        """没有小时明细（尚未结算）时按 24 小时平均电价估算"""
+        return float(total_kwh * self.hour_prices.mean() + self.tier_fees(total_kwh))
+
+
+def _valley_mask(spec):
+    try:
+        start, end = (int(h) % 24 for h in str(spec).split("-"))
+    except ValueError:
+        start, end = 22, 8
+    hours = np.arange(24)
+    if start <= end:
+        return (hours >= start) & (hours < end)
+    return (hours >= start) | (hours < end)
+
+
+def _float_list(value):
+    try:
+        return [float(v) for v in str(value).split(",") if v.strip()]
+    except ValueError:
+        return []
+
+
+_tariff = None
+_tariff_version = None
+_tariff_lock = threading.Lock()
+
+
+def get_tariff():
+    """当前电价，配置变更（option_cache.version 变化）后重新编译"""
+    global _tariff, _tariff_version
+    option_cache.all()
+    with _tariff_lock:
+        if _tariff is None or _tariff_version != option_cache.version:
+            _tariff = Tariff()
+            _tariff_version = option_cache.version
+        return _tariff
+
+
+def bill_month(year, month, lo, hi, tariff=None):
+    """
+    计算 year-month、电表 id 在 [lo, hi] 的账单并覆盖写入 Bill，返回写入行数。
+    该月已没有用电数据的电表账单清零（与 rebuild_usage 重算 MonthlyUsage 的处理一致）。
+    """
+    tariff = tariff or get_tariff()
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+
+    rows = list(
+        HourlyUsage.objects
+        .filter(meter_id__gte=lo, meter_id__lte=hi, day__range=(first, last))
+        .values("meter_id", "hour")
+        .annotate(total=Sum("kwh"))
+        .values_list("meter_id", "hour", "total")
+    )
+
+    with transaction.atomic():
+        Bill.objects.filter(meter_id__gte=lo, meter_id__lte=hi, year=year, month=month).update(
+            total_kwh=0, total_fee=0,
+        )
+        if not rows:
+            return 0
+
+        meter_ids, hours, kwh = (np.array(c) for c in zip(*rows))
+        pks, index = np.unique(meter_ids, return_inverse=True)
+        hourly = np.zeros((len(pks), 24))
+        np.add.at(hourly, (index, hours.astype(int)), kwh.astype(float))
+
+        totals = hourly.sum(axis=1)
+        fees = tariff.fees(hourly)
+        generated = timezone.now()
+        return bulk_upsert(
+            Bill, ["meter", "year", "month"], ["total_kwh", "total_fee", "generate_time"],
+            [
+                (pk, year, month, round(total, 4), round(fee, 2), generated)
+                for pk, total, fee in zip(pks.tolist(), totals.tolist(), fees.tolist())
+            ],
+        )
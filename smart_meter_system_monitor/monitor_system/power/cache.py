@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import quote_etag
+
+EPOCH_KEY = "trend:epoch"
+CLOSED_KEY = "trend:closed"
+
+
+class TrendCache:
+    """
+    趋势接口（日/周/月）响应缓存，存放在 Django cache（默认 Redis，多进程共享）。
+
+    key = trend:<view>:<meter_pk>:<period>:<版本号>，版本号由三部分组成（均为最后写入时间，纳秒）：
+      - 全局 epoch：close_day / rebuild_usage 批量改写历史数据后整体失效；
+      - 电表历史版本：usage_accumulator 写入今天以前的数据（晚到读数）时更新；
+      - 电表当前版本：usage_accumulator 写入今天的数据时更新，只参与包含今天的周期。
+    历史周期不过期，当前周期另有 TREND_CACHE_TTL 兜底；
+    同一组版本号也用作 HTTP 条件请求的 ETag / Last-Modified（见 validators）。
+    close_day 结算完成后记录已结算到的日期（mark_closed），截止该日期的周期才允许浏览器长时间缓存。
+    缓存不可用时直接计算，不影响接口。
+    """
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def versions(self, meter_pk):
+        """(epoch, 历史版本, 当前版本)，缓存不可用时返回 None"""
+        try:
+            return self._versions(meter_pk)
+        except Exception:
+            return None
+
+    def _versions(self, meter_pk):
+        keys = [EPOCH_KEY, f"trend:hv:{meter_pk}", f"trend:cv:{meter_pk}"]
+        found = self.cache.get_many(keys)
+        versions = []
+        for key in keys:
+            if key not in found:
+                # 版本号被淘汰后不能从 0 重新开始，否则会命中旧数据
+                self.cache.add(key, time.time_ns(), None)
+                found[key] = self.cache.get(key)
+            versions.append(found[key])
+        return tuple(versions)
+
+    def validators(self, versions, view, meter_pk, period, current):
+        """由版本号生成 (ETag, Last-Modified 时间戳)；历史周期不受当前版本影响"""
+        used = versions if current else versions[:2]
+        raw = f"{view}:{meter_pk}:{period}:" + ".".join(map(str, used))
+        etag = quote_etag(hashlib.sha1(raw.encode()).hexdigest()[:20])
+        return etag, max(used) // 10 ** 9
+
+    def get_or_compute(self, view, meter_pk, period, current, compute, versions=None):
+        """
+        current: 周期是否包含今天（或未来），是则 key 带上当前版本并设置过期时间
+        compute: 未命中时调用，返回可序列化的响应数据
+        versions: 调用方已取到的 versions()，避免重复读取
+        """
+        try:
+            epoch, history, today = versions or self._versions(meter_pk)
+            key = f"trend:{view}:{meter_pk}:{period}:{epoch}.{history}"
+            if current:
+                key += f".{today}"
+            data = self.cache.get(key)
+        except Exception:
+            return compute()
+
+        with self._lock:
+            if data is not None:
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = compute()
+        try:
+            self.cache.set(key, data, self.ttl if current else None)
+        except Exception:
+            pass
+        return data
+
+    def touch(self, meter_pks, history=False):
+        """电表有新数据写入：当前周期失效，history=True 时历史周期也失效"""
+        now = time.time_ns()
+        values = {}
+        for pk in meter_pks:
+            values[f"trend:cv:{pk}"] = now
+            if history:
+                values[f"trend:hv:{pk}"] = now
+        if not values:
+            return
+        try:
+            self.cache.set_many(values, None)
+        except Exception:
+            pass
+
+    def touch_all(self):
+        """全部电表的缓存失效（批量重算历史数据后调用）"""
+        try:
+            self.cache.set(EPOCH_KEY, time.time_ns(), None)
+        except Exception:
+            pass
+
+    def mark_closed(self, day):
+        """close_day 结算完 day 后调用：day 及以前的周期不再变化（重跑更早的日期不回退）"""
+        try:
+            closed = self.cache.get(CLOSED_KEY)
+            if closed is None or day.isoformat() > closed:
+                self.cache.set(CLOSED_KEY, day.isoformat(), None)
+        except Exception:
+            pass
+
+    def is_closed(self, last_day):
+        """截止 last_day 的周期是否已由 close_day 结算；记录丢失或缓存不可用时按未结算处理"""
+        try:
+            closed = self.cache.get(CLOSED_KEY)
+        except Exception:
+            return False
+        return closed is not None and last_day.isoformat() <= closed
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0,
+            }
+
+
+trend_cache = TrendCache(
+    "default",
+    getattr(settings, "TREND_CACHE_TTL", 300),
+)
@@ -0,0 +1,70 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.core.management.base import BaseCommand, CommandError
+
+# 在全新的解释器里模拟一个 worker 启动：setup Django 并加载全部路由（即导入全部视图），
+# eager 场景再加载报告渲染依赖，相当于改为按需加载之前每个 worker 的启动过程
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+if {eager}:
+    from power.reports import load_fonts
+    load_fonts()
+print(json.dumps({{
+    "seconds": time.perf_counter() - started,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy": sorted(m for m in ("matplotlib", "reportlab") if m in sys.modules),
+}}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "测量 worker 启动耗时与峰值内存：对比报告依赖（matplotlib / reportlab / 字体）按需加载与启动时加载，"
+        "每个场景在全新的 Python 进程中重复 --repeat 次取中位数"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5, help="每个场景的运行次数")
+
+    def handle(self, *args, **options):
+        if options["repeat"] <= 0:
+            raise CommandError("--repeat 必须大于 0")
+
+        results = {}
+        for name, eager in (("lazy", False), ("eager", True)):
+            runs = [self.probe(eager) for _ in range(options["repeat"])]
+            results[name] = {
+                "seconds": statistics.median(r["seconds"] for r in runs),
+                "rss_mb": statistics.median(r["rss_kb"] for r in runs) / 1024,
+                "heavy": runs[0]["heavy"],
+            }
+            r = results[name]
+            self.stdout.write(
+                f"{name:>5}: 启动 {r['seconds'] * 1000:.0f} ms，峰值 RSS {r['rss_mb']:.1f} MiB，"
+                f"已加载 {', '.join(r['heavy']) or '无'}"
+            )
+
+        lazy, eager = results["lazy"], results["eager"]
+        self.stdout.write(self.style.SUCCESS(
+            f"按需加载每个 worker 节省 {(eager['seconds'] - lazy['seconds']) * 1000:.0f} ms、"
+            f"{eager['rss_mb'] - lazy['rss_mb']:.1f} MiB"
+        ))
+
+    def probe(self, eager):
+        proc = subprocess.run(
+            [sys.executable, "-c", PROBE.format(eager=eager)],
+            # 子进程沿用当前的 sys.path 和 DJANGO_SETTINGS_MODULE
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)},
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise CommandError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "子进程执行失败")
+        return json.loads(proc.stdout.strip().splitlines()[-1])
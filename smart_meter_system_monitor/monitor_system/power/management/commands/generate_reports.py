@@ -0,0 +1,121 @@
+import os
+import time
+from concurrent.futures import as_completed
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from power.models import Bill, Meter, MonthlyUsage
+from power.reports import (
+    build_report_data, load_fonts, month_window, render_report_cached, report_cache, report_key,
+)
+from power.utils import fork_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "预先生成全部用户指定月份（默认上个月）的月度用电报告，写入报告缓存，"
+        "用户导出 ?year=&month= 的报告时直接命中。数据未变化（缓存中已有）的报告跳过。"
+        "建议由 cron 在每月 1 日日结之后执行，例如：30 0 1 * * python manage.py generate_reports"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="报告月份所在年，默认上个月")
+        parser.add_argument("--month", type=int, help="报告月份 1~12，默认上个月")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行渲染进程数")
+        parser.add_argument("--batch", type=int, default=20, help="每个任务渲染的报告数")
+
+    def handle(self, *args, **options):
+        last_month = date.today().replace(day=1) - timedelta(days=1)
+        year = options["year"] or last_month.year
+        month = options["month"] or last_month.month
+        if not 1 <= month <= 12:
+            raise CommandError("--month 必须在 1~12 之间")
+        if options["workers"] <= 0 or options["batch"] <= 0:
+            raise CommandError("--workers / --batch 必须大于 0")
+
+        started = time.monotonic()
+        reports = load_fleet_reports((year, month))
+        pending = [data for data in reports
+                   if not os.path.exists(report_cache.path(report_key(data), "pdf"))]
+        skipped = len(reports) - len(pending)
+        self.stdout.write(
+            f"{year}-{month:02d}：{len(reports)} 个用户，{skipped} 份未变化跳过，"
+            f"{len(pending)} 份待生成（加载 {time.monotonic() - started:.1f}s）"
+        )
+        if not pending:
+            return
+
+        batch = options["batch"]
+        batches = [pending[i:i + batch] for i in range(0, len(pending), batch)]
+
+        # fork 出的子进程会继承父进程的数据库连接，先全部关闭（渲染本身不访问数据库）
+        connections.close_all()
+        # 渲染依赖在 fork 前加载一次，子进程直接继承
+        load_fonts()
+
+        rendered, size = 0, 0
+        render_started = time.monotonic()
+        with fork_pool(options["workers"]) as pool:
+            futures = [pool.submit(render_reports, b) for b in batches]
+            for future in as_completed(futures):
+                count, nbytes = future.result()
+                rendered += count
+                size += nbytes
+                elapsed = time.monotonic() - render_started
+                self.stdout.write(f"[{rendered}/{len(pending)}] {rendered / elapsed:.1f} 份/s")
+
+        elapsed = time.monotonic() - render_started
+        if size > report_cache.max_bytes:
+            self.stdout.write(self.style.WARNING(
+                f"本次生成 {size / 2 ** 20:.0f} MiB，超过 REPORT_CACHE_MAX_BYTES，"
+                "较早生成的报告会被淘汰，导出时重新渲染"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"生成完成：{rendered} 份（{size / 2 ** 20:.1f} MiB），跳过 {skipped} 份，"
+            f"渲染耗时 {elapsed:.1f}s，{rendered / elapsed:.1f} 份/s"
+        ))
+
+
+def load_fleet_reports(until):
+    """
+    三条查询加载全部用户的报告数据：每个用户取其第一块电表（与导出接口的 request.user.meters.first() 一致），
+    再分别读出窗口内全部月度数据和账单，按电表分组。
+    """
+    first_meters = {}
+    for user_id, pk, meter_id in (
+        Meter.objects.filter(user__isnull=False)
+        .order_by("user_id", "id")
+        .values_list("user_id", "id", "meter_id")
+        .iterator(chunk_size=10000)
+    ):
+        first_meters.setdefault(user_id, (pk, meter_id))
+
+    months = {pk: [] for pk, _ in first_meters.values()}
+    for pk, year, month, kwh in (
+        MonthlyUsage.objects.filter(month_window(until), meter__user__isnull=False)
+        .order_by("meter_id", "year", "month")
+        .values_list("meter_id", "year", "month", "kwh")
+        .iterator(chunk_size=10000)
+    ):
+        if pk in months:
+            months[pk].append((year, month, kwh))
+
+    fees = {pk: {} for pk in months}
+    for pk, year, month, fee in (
+        Bill.objects.filter(month_window(until), meter__user__isnull=False)
+        .values_list("meter_id", "year", "month", "total_fee")
+        .iterator(chunk_size=10000)
+    ):
+        if pk in fees:
+            fees[pk][(year, month)] = fee
+
+    return [build_report_data(meter_id, months[pk], fees[pk]) for pk, meter_id in first_meters.values()]
+
+
+def render_reports(batch):
+    """子进程任务：渲染一批报告写入缓存，返回 (份数, 字节数)"""
+    size = 0
+    for data in batch:
+        key = render_report_cached(data)
+        size += os.path.getsize(report_cache.path(key, "pdf"))
+    return len(batch), size
@@ -0,0 +1,241 @@
+import json
+import os
+import time
+from concurrent.futures import as_completed
+from datetime import date, datetime, timedelta
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from power.billing import bill_month
+from power.cache import trend_cache
+from power.models import DailyUsage, HourlyUsage, Meter, MonthlyUsage
+from power.utils import bulk_upsert, fork_pool, rollup_daily, rollup_fleet_hourly, rollup_monthly
+
+SOURCES = ("raw", "hourly")
+
+
+class Command(BaseCommand):
+    help = (
+        "按日期范围重算 HourlyUsage / DailyUsage / MonthlyUsage 及涉及月份的账单 Bill。"
+        "--source hourly（默认）只按小时数据重算日/月汇总；"
+        "--source raw 从 RealtimeUsage 原始读数积分重算小时数据，只替换有原始读数的 (电表, 日期)，"
+        "范围内有小时数据没有原始读数覆盖时拒绝执行（需加 --force）。"
+        "电表分批交给进程池并行处理，每完成一批写入断点文件，中断后重新执行同样的命令即可续跑。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", required=True, help="起始日期 YYYY-MM-DD（含）")
+        parser.add_argument("--to", dest="end", required=True, help="结束日期 YYYY-MM-DD（含），须早于今天")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数")
+        parser.add_argument("--source", choices=SOURCES, default="hourly", help="重算数据来源，默认 hourly")
+        parser.add_argument(
+            "--force", action="store_true",
+            help="raw：有小时数据没有原始读数覆盖时仍然执行（有原始读数的日期整天替换，其余日期不变）",
+        )
+        parser.add_argument("--batch", type=int, default=100, help="每个任务处理的电表数")
+        parser.add_argument("--checkpoint", help="断点文件路径，默认按参数生成在当前目录")
+        parser.add_argument("--restart", action="store_true", help="忽略已有断点，从头开始")
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options["start"], "%Y-%m-%d").date()
+            end = datetime.strptime(options["end"], "%Y-%m-%d").date()
+        except ValueError:
+            raise CommandError("日期格式错误，应为 YYYY-MM-DD")
+        if start > end:
+            raise CommandError("--from 不能晚于 --to")
+        if end >= date.today():
+            # 当天数据仍在由 usage_accumulator 实时累加，重算会与之冲突
+            raise CommandError("--to 必须早于今天")
+        if options["workers"] <= 0 or options["batch"] <= 0:
+            raise CommandError("--workers / --batch 必须大于 0")
+
+        source = options["source"]
+        path = options["checkpoint"] or f".rebuild_usage_{source}_{start}_{end}.json"
+        checkpoint = Checkpoint(path, {"source": source, "from": str(start), "to": str(end)})
+        if options["restart"]:
+            checkpoint.reset()
+
+        pks = [pk for pk in Meter.objects.order_by("id").values_list("id", flat=True)
+               if pk not in checkpoint.done]
+        total = len(pks) + len(checkpoint.done)
+        if checkpoint.done:
+            self.stdout.write(f"从断点 {path} 继续：已完成 {len(checkpoint.done)}/{total} 块电表")
+        if not pks:
+            # 上次可能在全部批次完成后、汇总全网合计前中断
+            rollup_fleet_hourly(start, end)
+            checkpoint.remove()
+            self.stdout.write(self.style.SUCCESS("没有需要重算的电表"))
+            return
+
+        batches = [pks[i:i + options["batch"]] for i in range(0, len(pks), options["batch"])]
+
+        # fork 出的子进程会继承父进程的数据库连接，先全部关闭，子进程各自重连
+        connections.close_all()
+
+        started = time.monotonic()
+        finished = 0
+        rows = 0
+        with fork_pool(options["workers"]) as pool:
+            if source == "raw" and not options["force"]:
+                # 原始读数可能没有覆盖整个范围（RealtimeUsage 启用之前、采样关闭期间），先检查再改写
+                gaps = sum(f.result() for f in [pool.submit(missing_raw_hours, b, start, end) for b in batches])
+                if gaps:
+                    raise CommandError(
+                        f"范围内有 {gaps} 个 (电表, 小时) 的 HourlyUsage 没有原始读数覆盖，raw 重算会丢失这些数据。"
+                        "请改用 --source hourly，或确认后加 --force（只替换有原始读数的日期）"
+                    )
+
+            futures = {pool.submit(rebuild_meters, batch, start, end, source): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                rows += future.result()
+                finished += len(batch)
+                checkpoint.add(batch)
+
+                elapsed = time.monotonic() - started
+                eta = elapsed / finished * (len(pks) - finished)
+                self.stdout.write(
+                    f"[{len(checkpoint.done)}/{total}] 电表已完成，"
+                    f"写入 {rows} 行，耗时 {elapsed:.1f}s，预计剩余 {eta:.1f}s"
+                )
+
+        # 全网合计依赖全部电表，所有批次完成后在主进程汇总
+        rollup_fleet_hourly(start, end)
+        checkpoint.remove()
+        trend_cache.touch_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"重算完成：{start} ~ {end}，{len(pks)} 块电表，{rows} 行，"
+            f"耗时 {time.monotonic() - started:.1f}s"
+        ))
+
+
+class Checkpoint:
+    """断点文件：记录已完成的电表 id，参数不一致时拒绝续跑"""
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("params") != params:
+                raise CommandError(f"断点文件 {path} 与本次参数不一致，请加 --restart")
+            self.done = set(data.get("done", []))
+
+    def add(self, pks):
+        self.done.update(pks)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"params": self.params, "done": sorted(self.done)}, f)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.done = set()
+        self.remove()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def rebuild_meters(pks, start, end, source):
+    """子进程任务：重算一批电表，返回写入行数"""
+    try:
+        if source == "raw":
+            hourly, coverage = integrate_raw(pks, start, end)
+            with transaction.atomic():
+                # 只替换有原始读数的 (电表, 日期)，没有原始读数的日期保留原有小时数据
+                for pk, hours in coverage.items():
+                    HourlyUsage.objects.filter(meter_id=pk, day__in={day for day, _ in hours}).delete()
+                count = bulk_upsert(HourlyUsage, ["meter", "day", "hour"], ["kwh"], hourly)
+                count += rebuild_rollups(pks, start, end)
+        else:
+            with transaction.atomic():
+                count = rebuild_rollups(pks, start, end)
+        return count
+    finally:
+        connections.close_all()
+
+
+def hour_edges(start, end):
+    """[start, end] 内每个本地整点的时间戳（含结束边界），及对应的 (day, hour)"""
+    edges, keys = [], []
+    t = datetime.combine(start, datetime.min.time())
+    stop = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    while t < stop:
+        edges.append(time.mktime(t.timetuple()))
+        keys.append((t.date(), t.hour))
+        t += timedelta(hours=1)
+    edges.append(time.mktime(stop.timetuple()))
+    return np.array(edges), keys
+
+
+def integrate_raw(pks, start, end):
+    """
+    从 RealtimeUsage 原始读数积分出每小时电量，算法与 process_meter_update 一致：
+    每条读数的功率 × 距上一条读数的时长，计入该读数所在的本地小时。
+    原始读数按 RAW_READING_SAMPLE_EVERY 采样落盘时，相邻两条之间的间隔会更长，结果为近似值。
+
+    返回 (rows, coverage)：rows 为 [(meter_pk, day, hour, kwh), ...]，
+    coverage 为 {meter_pk: {(day, hour), ...}}，即有原始读数（计入了电量）的小时。
+    """
+    from monitor.consumers import energy_kwh
+    from monitor.models import RealtimeUsage
+
+    edges, keys = hour_edges(start, end)
+    lo = datetime.fromtimestamp(edges[0]).astimezone()
+    hi = datetime.fromtimestamp(edges[-1]).astimezone()
+
+    rows, coverage = [], {}
+    for pk in pks:
+        # 范围起点之前的最后一条读数作为第一段的起点
+        prev = (RealtimeUsage.objects.filter(meter_id=pk, timestamp__lt=lo)
+                .order_by("-timestamp").values_list("timestamp", "power_usage").first())
+        readings = list(RealtimeUsage.objects.filter(meter_id=pk, timestamp__gte=lo, timestamp__lt=hi)
+                        .order_by("timestamp").values_list("timestamp", "power_usage"))
+        if prev:
+            readings.insert(0, prev)
+        if len(readings) < 2:
+            continue
+
+        ts = np.array([r[0].timestamp() for r in readings])
+        power = np.array([r[1] for r in readings], dtype=float)
+        kwh = energy_kwh(power[1:], np.diff(ts))
+
+        bucket = np.searchsorted(edges, ts[1:], side="right") - 1
+        totals = np.bincount(bucket, weights=kwh, minlength=len(keys))[:len(keys)]
+        for i in np.flatnonzero(totals):
+            day, hour = keys[i]
+            rows.append((pk, day, hour, float(totals[i])))
+        coverage[pk] = {keys[i] for i in np.unique(bucket).tolist()}
+    return rows, coverage
+
+
+def missing_raw_hours(pks, start, end):
+    """子进程任务：有电量但没有原始读数覆盖的 (电表, 小时) 数，raw 重算会改写或跳过这些小时"""
+    try:
+        _, coverage = integrate_raw(pks, start, end)
+        existing = HourlyUsage.objects.filter(
+            meter_id__in=pks, day__range=(start, end), kwh__gt=0,
+        ).values_list("meter_id", "day", "hour")
+        return sum(1 for pk, day, hour in existing if (day, hour) not in coverage.get(pk, ()))
+    finally:
+        connections.close_all()
+
+
+def rebuild_rollups(pks, start, end):
+    """按 HourlyUsage 重算范围内的 DailyUsage，再按 DailyUsage 重算涉及月份的 MonthlyUsage，按 HourlyUsage 重算其账单"""
+    lo, hi = min(pks), max(pks)
+    DailyUsage.objects.filter(meter_id__gte=lo, meter_id__lte=hi, day__range=(start, end)).delete()
+    count = max(rollup_daily(start, end, lo, hi), 0)
+
+    d = start.replace(day=1)
+    while d <= end:
+        # 整月已无用电的先清零，再按 DailyUsage 覆盖
+        MonthlyUsage.objects.filter(meter_id__gte=lo, meter_id__lte=hi, year=d.year, month=d.month).update(kwh=0)
+        count += max(rollup_monthly(d.year, d.month, lo, hi), 0)
+        count += bill_month(d.year, d.month, lo, hi)
+        d = (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return count
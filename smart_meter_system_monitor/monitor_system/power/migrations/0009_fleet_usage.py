@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('power', '0008_realtimealert_bill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetHourlyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('hour', models.IntegerField()),
+                ('kwh', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailyusage',
+            index=models.Index(fields=['day', 'kwh'], name='daily_day_kwh_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyusage',
+            index=models.Index(fields=['day', 'hour', 'kwh'], name='hourly_day_hour_kwh_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='monthlyusage',
+            index=models.Index(fields=['year', 'month', 'kwh'], name='monthly_ym_kwh_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fleethourlyusage',
+            unique_together={('day', 'hour')},
+        ),
+    ]
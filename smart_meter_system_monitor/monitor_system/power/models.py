@@ -23,6 +23,10 @@ class DailyUsage(models.Model):
 
     class Meta:
         unique_together = ("meter", "day")
+        indexes = [
+            # 全网按天排名 / 分布统计（覆盖索引，不回表）
+            models.Index(fields=["day", "kwh"], name="daily_day_kwh_idx"),
+        ]
 
 
 class MonthlyUsage(models.Model):
@@ -33,6 +37,9 @@ class MonthlyUsage(models.Model):
 
     class Meta:
         unique_together = ("meter", "year", "month")
+        indexes = [
+            models.Index(fields=["year", "month", "kwh"], name="monthly_ym_kwh_idx"),
+        ]
 
     def __str__(self):
         return f"{self.year}-{self.month} Meter={self.meter.meter_id}"
@@ -45,6 +52,19 @@ class HourlyUsage(models.Model):
 
     class Meta:
         unique_together = ("meter", "day", "hour")
+        indexes = [
+            models.Index(fields=["day", "hour", "kwh"], name="hourly_day_hour_kwh_idx"),
+        ]
+
+
+class FleetHourlyUsage(models.Model):
+    """全部电表每小时用电量合计，由 usage_accumulator 随 HourlyUsage 一起累加（日/月合计由此汇总）"""
+    day = models.DateField()
+    hour = models.IntegerField()  # 0~23
+    kwh = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ("day", "hour")
 
 
 class ClientMeterSnapshot(models.Model):
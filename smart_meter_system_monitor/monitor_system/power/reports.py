@@ -0,0 +1,518 @@
+"""
+用电分析报告：数据加载、趋势图与 PDF 渲染、渲染结果磁盘缓存、后台任务池。
+
+渲染只用 matplotlib 面向对象接口（Figure），不经过 pyplot 的全局状态，线程内调用也安全；
+渲染函数只接收普通数据（dict），可以直接交给子进程执行。
+
+matplotlib / reportlab 和字体注册在第一次渲染时才加载（load_fonts），
+导入本模块（以及 power.views、manage.py 命令）不承担它们的启动时间和内存，见 bench_startup 命令。
+"""
+import functools
+import hashlib
+import json
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from django.conf import settings
+
+FONT_PATH = os.path.join(
+    settings.BASE_DIR, 'static', 'fonts', 'simfang.ttf'
+)
+
+
+@functools.lru_cache(maxsize=None)
+def load_fonts():
+    """加载 matplotlib / reportlab 并注册中文字体（仿宋，每个进程一次），返回 matplotlib 字体属性"""
+    from matplotlib import font_manager, rcParams
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    # ========== 1. reportlab 注册中文字体 ==========
+    pdfmetrics.registerFont(TTFont('Chinese', FONT_PATH))
+
+    # ========== 2. matplotlib 使用同一字体 ==========
+    font_prop = font_manager.FontProperties(fname=FONT_PATH)
+    rcParams['font.family'] = font_prop.get_name()
+    rcParams['axes.unicode_minus'] = False
+    return font_prop
+
+
+# 图表或 PDF 版式改动后加 1，旧的缓存文件不再命中，由 LRU 自然淘汰
+TEMPLATE_VERSION = 1
+
+
+def month_window(until, count=12):
+    """截至 until=(year, month) 的 count 个自然月的查询条件"""
+    from django.db.models import Q
+
+    year, month = until
+    idx = year * 12 + month - count
+    start_year, start_month = idx // 12, idx % 12 + 1
+    return (
+        (Q(year__gt=start_year) | Q(year=start_year, month__gte=start_month))
+        & (Q(year__lt=year) | Q(year=year, month__lte=month))
+    )
+
+
+def load_report_months(meter, count=12, until=None):
+    """
+    报告的 (year, month, kwh)，按时间正序：
+    until 为空时取最近 count 条月度数据；指定 until=(year, month) 时取截至该月的 count 个自然月（月度报告）
+    """
+    from .models import MonthlyUsage
+
+    qs = MonthlyUsage.objects.filter(meter=meter)
+    if until:
+        qs = qs.filter(month_window(until, count))
+    rows = list(qs.order_by('-year', '-month').values_list('year', 'month', 'kwh')[:count])
+    rows.reverse()
+    return rows
+
+
+def build_report_data(meter_id, months, fees):
+    """
+    months: 按时间正序的 (year, month, kwh)
+    fees: {(year, month): 账单电费}，没有账单（尚未结算）的月份按当前电价估算
+    """
+    from .billing import get_tariff
+
+    tariff = get_tariff()
+    total_fee = sum(
+        fees[(y, m)] if (y, m) in fees else tariff.estimate(kwh)
+        for y, m, kwh in months
+    )
+    return {
+        "meter_id": meter_id,
+        "months": [list(m) for m in months],
+        "total_fee": round(total_fee, 2),
+    }
+
+
+def report_data(meter, until=None):
+    """生成报告所需的全部数据（可序列化，交给子进程渲染）"""
+    from .models import Bill
+
+    months = load_report_months(meter, until=until)
+    fees = {}
+    if months:
+        fees = {
+            (y, m): fee for y, m, fee in Bill.objects.filter(
+                meter=meter, year__gte=months[0][0], year__lte=months[-1][0],
+            ).values_list("year", "month", "total_fee")
+        }
+    return build_report_data(meter.meter_id, months, fees)
+
+
+def render_chart(data):
+    """月度用电趋势图（PNG 字节）"""
+    from matplotlib.figure import Figure
+
+    font_prop = load_fonts()
+    months = data["months"]
+    labels = [f"{y}-{m:02d}" for y, m, _ in months]
+    values = [kwh for _, _, kwh in months]
+
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+
+    if len(values) < 2:
+        ax.scatter(labels, values, s=80)
+        ax.set_title("当前月用电量", fontproperties=font_prop)
+    else:
+        ax.plot(labels, values, marker='o', linewidth=2)
+        ax.set_title("最近 12 个月用电量趋势", fontproperties=font_prop)
+
+    ax.set_xlabel("月份", fontproperties=font_prop)
+    ax.set_ylabel("用电量 (kWh)", fontproperties=font_prop)
+    ax.grid(True, linestyle='--', alpha=0.6)
+    ax.tick_params(axis='x', labelrotation=45)
+
+    buf = BytesIO()
+    fig.savefig(buf, dpi=150, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def render_pdf(data, chart_png):
+    """用电分析报告 PDF（字节）"""
+    from reportlab.platypus import (
+        SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage, PageBreak
+    )
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+    from reportlab.lib import colors
+
+    load_fonts()
+    months = data["months"]
+
+    # ========= 统计数据 =========
+    total_kwh = sum(kwh for _, _, kwh in months)
+    total_money = data["total_fee"]
+    avg_daily = total_kwh / 30 if total_kwh else 0
+    avg_month = total_kwh / len(months) if months else 0
+
+    # ========= PDF 初始化 =========
+    buf = BytesIO()
+    doc = SimpleDocTemplate(
+        buf,
+        pagesize=A4,
+        topMargin=2 * cm,
+        bottomMargin=2 * cm
+    )
+
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(
+        name='TitleCN', fontName='Chinese',
+        fontSize=20, alignment=1, spaceAfter=20
+    ))
+    styles.add(ParagraphStyle(
+        name='NormalCN', fontName='Chinese',
+        fontSize=12, leading=18
+    ))
+    styles.add(ParagraphStyle(
+        name='HeadingCN', fontName='Chinese',
+        fontSize=14, spaceBefore=12, spaceAfter=8
+    ))
+
+    story = []
+
+    # ========= 封面 / 标题 =========
+    story.append(Paragraph("家庭智能用电分析报告", styles['TitleCN']))
+    story.append(Spacer(1, 30))
+
+    story.append(Paragraph(
+        "本报告基于智能电表采集的历史用电数据，"
+        "对家庭用电情况进行统计分析与趋势评估，"
+        "为用户提供科学的用电决策参考。",
+        styles['NormalCN']
+    ))
+    story.append(PageBreak())
+
+    # ========= 基本信息 =========
+    story.append(Paragraph("一、基本用电信息", styles['HeadingCN']))
+
+    info_table = Table([
+        ["电表编号", data["meter_id"]],
+        ["统计周期", "最近 12 个月"],
+        ["总用电量", f"{total_kwh:.2f} kWh"],
+        ["总电费", f"¥{total_money:.2f}"],
+        ["日均用电量", f"{avg_daily:.2f} kWh"],
+        ["月均用电量", f"{avg_month:.2f} kWh"],
+    ], colWidths=[5 * cm, 9 * cm])
+
+    info_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'Chinese'),
+        ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (0, -1), colors.whitesmoke),
+    ]))
+
+    story.append(info_table)
+    story.append(Spacer(1, 20))
+
+    # ========= 趋势分析 =========
+    story.append(Paragraph("二、用电趋势分析", styles['HeadingCN']))
+    story.append(RLImage(BytesIO(chart_png), width=15 * cm, height=8 * cm))
+    story.append(Spacer(1, 12))
+
+    story.append(Paragraph(
+        "从用电趋势图可以看出，家庭整体用电情况较为稳定，"
+        "未出现明显的异常峰值，说明家庭用电行为相对规律。",
+        styles['NormalCN']
+    ))
+
+    # ========= 节能建议 =========
+    story.append(Spacer(1, 20))
+    story.append(Paragraph("三、节能建议", styles['HeadingCN']))
+
+    tips = [
+        "合理安排大功率电器的使用时间，避免集中使用。",
+        "选用高能效等级家用电器以降低长期用电成本。",
+        "夏季空调温度建议不低于 26℃，冬季不高于 20℃。",
+        "外出或长期不用时，及时关闭待机电器。"
+    ]
+
+    for tip in tips:
+        story.append(Paragraph(f"• {tip}", styles['NormalCN']))
+        story.append(Spacer(1, 6))
+
+    # ========= 系统说明 =========
+    story.append(Spacer(1, 20))
+    story.append(Paragraph("四、系统说明", styles['HeadingCN']))
+    story.append(Paragraph(
+        "本分析报告由家庭智能用电监测系统自动生成，"
+        "可辅助用户了解用电行为并优化用电策略。",
+        styles['NormalCN']
+    ))
+
+    doc.build(story)
+    return buf.getvalue()
+
+
+def render_report(data):
+    return render_pdf(data, render_chart(data))
+
+
+# ======================
+# 渲染结果缓存
+# ======================
+
+@functools.lru_cache(maxsize=None)
+def font_digest():
+    """字体文件内容摘要（每个进程只计算一次），替换字体后缓存 key 随之改变"""
+    h = hashlib.sha256()
+    with open(FONT_PATH, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _digest(kind, payload):
+    raw = json.dumps(
+        [kind, TEMPLATE_VERSION, font_digest(), payload],
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def chart_key(data):
+    # 趋势图只取决于月度数据，电费等变化时可复用
+    return _digest("chart", data["months"])
+
+
+def report_key(data):
+    return _digest("pdf", data)
+
+
+class ReportCache:
+    """
+    报告 PDF 与趋势图 PNG 的磁盘缓存，按内容寻址：
+    文件名是输入数据 + TEMPLATE_VERSION + 字体摘要的 sha256，数据不变时重复导出直接返回已有文件，
+    数据变化后 key 随之变化，不需要主动失效。
+
+    写入用临时文件 + rename，多个进程同时写同一 key 也不会读到半个文件；
+    命中时更新 mtime 作为最近使用时间，总大小超过 REPORT_CACHE_MAX_BYTES 时按 mtime 从旧到新淘汰。
+    为避免每次写入都遍历目录，每个进程累计写入超过预算的 1/10 才检查一次。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{ext}")
+
+    def open(self, key, ext):
+        """打开缓存文件（二进制），未命中返回 None"""
+        path = self.path(key, ext)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # 刚好被淘汰：已打开的文件仍可完整读取
+            pass
+        return f
+
+    def get(self, key, ext):
+        """缓存内容（bytes），未命中返回 None"""
+        f = self.open(key, ext)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def put(self, key, ext, content):
+        path = self.path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._written += len(content)
+            due = self._written * 10 >= self.max_bytes
+            if due:
+                self._written = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """总大小超过预算时删除最久未使用的文件，返回删除的文件数"""
+        entries, total = [], 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+report_cache = ReportCache(
+    getattr(settings, "REPORT_CACHE_DIR", os.path.join(settings.BASE_DIR, "var", "report_cache")),
+    getattr(settings, "REPORT_CACHE_MAX_BYTES", 512 * 1024 * 1024),
+)
+
+
+def render_report_cached(data):
+    """渲染报告写入缓存并返回 key；PDF 或趋势图已缓存时跳过对应的渲染"""
+    key = report_key(data)
+    if os.path.exists(report_cache.path(key, "pdf")):
+        return key
+
+    ckey = chart_key(data)
+    chart_png = report_cache.get(ckey, "png")
+    if chart_png is None:
+        chart_png = render_chart(data)
+        report_cache.put(ckey, "png", chart_png)
+
+    report_cache.put(key, "pdf", render_pdf(data, chart_png))
+    return key
+
+
+# ======================
+# 后台任务
+# ======================
+
+def _write_json(path, payload):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def run_report_job(job_dir, job_id, data):
+    """子进程执行：渲染 PDF 写入报告缓存，并在 <job_id>.json 状态中记录缓存 key"""
+    status_path = os.path.join(job_dir, f"{job_id}.json")
+    with open(status_path) as f:
+        status = json.load(f)
+
+    try:
+        key = render_report_cached(data)
+        status.update(status="done", finished=time.time(), key=key)
+    except Exception as e:
+        status.update(status="failed", finished=time.time(), error=str(e))
+    _write_json(status_path, status)
+
+
+class ReportJobs:
+    """
+    报告生成任务池：渲染在 REPORT_WORKERS 个子进程中执行，API 进程只负责提交和查询，
+    月初集中导出时不会占满 API worker。
+
+    任务状态保存在 REPORT_JOB_DIR 下（<job_id>.json），PDF 写入报告缓存（report_cache），
+    同一台机器上的任意 API 进程都能查询和下载；超过 REPORT_JOB_TTL 秒的任务文件在提交新任务时清理。
+    子进程用 spawn 方式启动，不继承 API 进程的线程和数据库连接。
+    """
+
+    def __init__(self, job_dir, workers, timeout, ttl):
+        self.job_dir = str(job_dir)
+        self.workers = workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_pool(self, broken=None):
+        with self._lock:
+            if self._pool is None or self._pool is broken:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def _status_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def submit(self, owner_id, data):
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.cleanup()
+
+        job_id = uuid.uuid4().hex
+        _write_json(self._status_path(job_id), {
+            "job_id": job_id,
+            "owner": owner_id,
+            "meter_id": data["meter_id"],
+            "status": "pending",
+            "created": time.time(),
+        })
+
+        pool = self._get_pool()
+        try:
+            future = pool.submit(run_report_job, self.job_dir, job_id, data)
+        except BrokenProcessPool:
+            # 有子进程异常退出后整个进程池不可用，换一个新的
+            future = self._get_pool(broken=pool).submit(run_report_job, self.job_dir, job_id, data)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        # 子进程崩溃（如被 OOM 杀掉）时 run_report_job 来不及写状态，在这里补上
+        error = future.exception()
+        if error is not None:
+            status = self.status(job_id) or {"job_id": job_id}
+            status.update(status="failed", finished=time.time(), error=str(error))
+            _write_json(self._status_path(job_id), status)
+
+    def status(self, job_id):
+        """任务状态 dict，不存在返回 None；pending 超过 REPORT_JOB_TIMEOUT 秒视为失败"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._status_path(job_id)) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if status["status"] == "pending" and time.time() - status["created"] > self.timeout:
+            status.update(status="failed", error="timeout")
+        return status
+
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.job_dir):
+            path = os.path.join(self.job_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+report_jobs = ReportJobs(
+    getattr(settings, "REPORT_JOB_DIR", os.path.join(settings.BASE_DIR, "var", "report_jobs")),
+    getattr(settings, "REPORT_WORKERS", 2),
+    getattr(settings, "REPORT_JOB_TIMEOUT", 300),
+    getattr(settings, "REPORT_JOB_TTL", 86400),
+)
@@ -1,3 +1,275 @@
-from django.test import TestCase
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from monitor.models import RealtimeUsage
+from power import reports
+from power.billing import Tariff, bill_month
+from power.cache import trend_cache
+from power.management.commands import generate_bills, generate_reports, rebuild_usage
+from power.models import Bill, DailyUsage, HourlyUsage, Meter, MonthlyUsage
+from system.models import SystemOption
+from system.utils import option_cache
+from user.models import User
 
-# Create your tests here.
+
+class RebuildUsageTests(TransactionTestCase):
+    # rebuild_meters 在 finally 里关闭连接，不能放在 TestCase 的外层事务里
+
+    def setUp(self):
+        self.day = date.today() - timedelta(days=3)
+        self.meter = Meter.objects.create(meter_id="rb")
+
+    def add_raw(self, day, hours, power_w=1000):
+        """从 day 0 点前 1 分钟起每分钟一条读数，持续 hours 小时（1000 W → 每小时 1 kWh）"""
+        base = time.mktime(day.timetuple())
+        RealtimeUsage.objects.bulk_create([
+            RealtimeUsage(
+                meter=self.meter,
+                timestamp=datetime.fromtimestamp(base + k * 60, tz=timezone.utc),
+                power_usage=power_w,
+            )
+            for k in range(-1, hours * 60)
+        ])
+
+    def hourly(self, day):
+        return dict(HourlyUsage.objects.filter(meter=self.meter, day=day).values_list("hour", "kwh"))
+
+    def test_default_source_is_hourly(self):
+        parser = rebuild_usage.Command().create_parser("manage.py", "rebuild_usage")
+        options = parser.parse_args(["--from", str(self.day), "--to", str(self.day)])
+        self.assertEqual(options.source, "hourly")
+        self.assertFalse(options.force)
+
+    def test_raw_replaces_only_days_with_readings(self):
+        next_day = self.day + timedelta(days=1)
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=20, kwh=42)
+        HourlyUsage.objects.create(meter=self.meter, day=next_day, hour=5, kwh=7)
+        self.add_raw(self.day, 3)
+
+        rebuild_usage.rebuild_meters([self.meter.pk], self.day, next_day, "raw")
+
+        hourly = self.hourly(self.day)
+        self.assertEqual(sorted(hourly), [0, 1, 2])
+        for kwh in hourly.values():
+            self.assertAlmostEqual(kwh, 1.0)
+        # 没有原始读数的日期保持不变，日汇总按小时数据重算
+        self.assertEqual(self.hourly(next_day), {5: 7})
+        daily = dict(DailyUsage.objects.filter(meter=self.meter).values_list("day", "kwh"))
+        self.assertAlmostEqual(daily[self.day], 3.0)
+        self.assertAlmostEqual(daily[next_day], 7.0)
+
+    def test_raw_keeps_meter_without_readings(self):
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=8, kwh=2.5)
+        rebuild_usage.rebuild_meters([self.meter.pk], self.day, self.day, "raw")
+        self.assertEqual(self.hourly(self.day), {8: 2.5})
+
+    def test_missing_raw_hours(self):
+        self.add_raw(self.day, 3)
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=1, kwh=1)
+        self.assertEqual(rebuild_usage.missing_raw_hours([self.meter.pk], self.day, self.day), 0)
+
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=20, kwh=3)
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=21, kwh=0)
+        self.assertEqual(rebuild_usage.missing_raw_hours([self.meter.pk], self.day, self.day), 1)
+
+    def test_hourly_rebuilds_rollups(self):
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=1, kwh=1.5)
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=2, kwh=2)
+        DailyUsage.objects.create(meter=self.meter, day=self.day, kwh=99)
+        MonthlyUsage.objects.create(meter=self.meter, year=self.day.year, month=self.day.month, kwh=99)
+
+        rebuild_usage.rebuild_meters([self.meter.pk], self.day, self.day, "hourly")
+
+        self.assertEqual(DailyUsage.objects.get(meter=self.meter, day=self.day).kwh, 3.5)
+        self.assertEqual(self.hourly(self.day), {1: 1.5, 2: 2})
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.meter = Meter.objects.create(meter_id="cg")
+        self.day = date.today() - timedelta(days=1)
+        HourlyUsage.objects.create(meter=self.meter, day=self.day, hour=1, kwh=1.5)
+
+    def get(self, day, **headers):
+        return self.client.get("/power/trend/day", {"meter_id": "cg", "date": str(day)}, headers=headers)
+
+    def test_not_modified(self):
+        response = self.get(self.day)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.get(self.day, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # 晚到读数写入昨天后 ETag 变化
+        trend_cache.touch([self.meter.pk], history=True)
+        response = self.get(self.day, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_unclosed_day_is_revalidated(self):
+        # 0 点之后、close_day 之前，昨天仍可能被晚到读数改写
+        self.assertIn("no-cache", self.get(self.day)["Cache-Control"])
+        self.assertIn("no-cache", self.get(date.today())["Cache-Control"])
+
+    def test_closed_day_is_cacheable(self):
+        trend_cache.mark_closed(self.day)
+        trend_cache.mark_closed(self.day - timedelta(days=5))
+
+        cache_control = self.get(self.day)["Cache-Control"]
+        self.assertIn("public", cache_control)
+        self.assertIn("max-age=3600", cache_control)
+        self.assertNotIn("no-cache", cache_control)
+        self.assertIn("no-cache", self.get(date.today())["Cache-Control"])
+
+
+class BillingTests(TestCase):
+    def setUp(self):
+        self.meter = Meter.objects.create(meter_id="bl")
+        # 测试事务回滚不触发配置失效信号
+        self.addCleanup(option_cache.invalidate)
+
+    def set_options(self, **options):
+        for key, value in options.items():
+            SystemOption.objects.update_or_create(key=key, defaults={"value": value})
+
+    def test_time_of_use(self):
+        self.set_options(bill_peak_price="0.6", bill_valley_price="0.3", bill_valley_hours="22-8")
+        hourly = np.zeros((1, 24))
+        hourly[0, 23] = hourly[0, 7] = 1   # 谷时
+        hourly[0, 8] = hourly[0, 12] = 1   # 峰时
+        self.assertAlmostEqual(Tariff().fees(hourly)[0], 1.8)
+
+    def test_tier_surcharge_per_tier(self):
+        self.set_options(bill_peak_price="0.5", bill_valley_price="0.5",
+                         bill_tier_kwh="200,400", bill_tier_surcharge="0.05,0.3")
+        tariff = Tariff()
+        # 200~400 kWh 每 kWh 加 0.05，400 kWh 以上每 kWh 加 0.3，各档不累加
+        self.assertAlmostEqual(tariff.estimate(150), 75)
+        self.assertAlmostEqual(tariff.estimate(300), 150 + 5)
+        self.assertAlmostEqual(tariff.estimate(500), 250 + 10 + 30)
+
+    def test_invalid_tiers_are_ignored(self):
+        self.set_options(bill_tier_kwh="400,200", bill_tier_surcharge="0.05,0.3")
+        self.assertEqual(Tariff().tier_fees(1000), 0)
+
+    def test_bill_month(self):
+        self.set_options(bill_peak_price="0.6", bill_valley_price="0.3")
+        HourlyUsage.objects.create(meter=self.meter, day=date(2024, 1, 1), hour=23, kwh=2)
+        HourlyUsage.objects.create(meter=self.meter, day=date(2024, 1, 31), hour=12, kwh=1)
+        HourlyUsage.objects.create(meter=self.meter, day=date(2024, 2, 1), hour=12, kwh=5)
+
+        self.assertEqual(bill_month(2024, 1, self.meter.pk, self.meter.pk), 1)
+        bill = Bill.objects.get(meter=self.meter, year=2024, month=1)
+        self.assertAlmostEqual(bill.total_kwh, 3)
+        self.assertAlmostEqual(bill.total_fee, 1.2)
+
+        # 重算覆盖写入；该月已没有数据时清零
+        HourlyUsage.objects.filter(day__month=1).delete()
+        self.assertEqual(bill_month(2024, 1, self.meter.pk, self.meter.pk), 0)
+        bill.refresh_from_db()
+        self.assertEqual((bill.total_kwh, bill.total_fee), (0, 0))
+
+    def test_bill_view_fills_unbilled_months(self):
+        self.set_options(bill_peak_price="0.5", bill_valley_price="0.5")
+        user = User.objects.create_user(email="bl@example.com")
+        self.meter.user = user
+        self.meter.save()
+        today = date.today()
+        MonthlyUsage.objects.create(meter=self.meter, year=2023, month=5, kwh=10)
+        MonthlyUsage.objects.create(meter=self.meter, year=2024, month=1, kwh=3)
+        Bill.objects.create(meter=self.meter, year=2024, month=1, total_kwh=3, total_fee=1.2)
+        MonthlyUsage.objects.create(meter=self.meter, year=today.year, month=today.month, kwh=6)
+        Bill.objects.create(meter=self.meter, year=today.year, month=today.month, total_kwh=4, total_fee=2)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        bills = client.get("/power/bill/").json()["bills"]
+
+        self.assertEqual(bills, [
+            # 上次结算之后新增的 2 kWh 按当前电价估算
+            {"year": today.year, "month": today.month, "kwh": 6, "cost": 3, "estimated": True},
+            {"year": 2024, "month": 1, "kwh": 3, "cost": 1.2, "estimated": False},
+            # 没有账单的历史月份
+            {"year": 2023, "month": 5, "kwh": 10, "cost": 5, "estimated": True},
+        ])
+
+    def test_bill_view_revalidates_after_tariff_change(self):
+        self.set_options(bill_peak_price="0.5", bill_valley_price="0.5")
+        cache.clear()
+        self.addCleanup(cache.clear)
+        user = User.objects.create_user(email="bl@example.com")
+        self.meter.user = user
+        self.meter.save()
+        MonthlyUsage.objects.create(meter=self.meter, year=2023, month=5, kwh=10)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get("/power/bill/")
+        etag = response["ETag"]
+        self.assertEqual(client.get("/power/bill/", headers={"if_none_match": etag}).status_code, 304)
+
+        # 用电数据未变，调整电价后估算的电费随之变化
+        self.set_options(bill_peak_price="0.8", bill_valley_price="0.8")
+        response = client.get("/power/bill/", headers={"if_none_match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["bills"][0]["cost"], 8)
+
+    def test_generate_bills_month_range(self):
+        command = generate_bills.Command()
+        parser = command.create_parser("manage.py", "generate_bills")
+        options = vars(parser.parse_args(["--from", "2023-11", "--to", "2024-02"]))
+        self.assertEqual(command.parse_months(options), [(2023, 11), (2023, 12), (2024, 1), (2024, 2)])
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        self.addCleanup(option_cache.invalidate)
+        self.user = User.objects.create_user(email="rp@example.com")
+        self.meter = Meter.objects.create(meter_id="rp1", user=self.user)
+        Meter.objects.create(meter_id="rp2", user=self.user)
+        for year, month, kwh in [(2023, 1, 5), (2023, 2, 6), (2023, 12, 7), (2024, 1, 8), (2024, 3, 9)]:
+            MonthlyUsage.objects.create(meter=self.meter, year=year, month=month, kwh=kwh)
+        Bill.objects.create(meter=self.meter, year=2024, month=1, total_kwh=8, total_fee=4.4)
+
+    def test_month_window(self):
+        def months(until, count):
+            return list(
+                MonthlyUsage.objects.filter(reports.month_window(until, count), meter=self.meter)
+                .order_by("year", "month").values_list("year", "month")
+            )
+
+        self.assertEqual(months((2024, 1), 12), [(2023, 2), (2023, 12), (2024, 1)])
+        self.assertEqual(months((2024, 2), 2), [(2024, 1)])
+        self.assertEqual(months((2023, 12), 1), [(2023, 12)])
+        self.assertEqual(months((2024, 3), 15), [(2023, 1), (2023, 2), (2023, 12), (2024, 1), (2024, 3)])
+
+    def test_generated_report_matches_export(self):
+        """generate_reports 预先生成的报告与导出接口的缓存 key 一致，导出直接命中"""
+        fleet = generate_reports.load_fleet_reports((2024, 1))
+        self.assertEqual(len(fleet), 1)
+        self.assertEqual(fleet[0], reports.report_data(self.meter, (2024, 1)))
+
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        report_cache = reports.ReportCache(cache_dir.name, 2 ** 20)
+        report_cache.put(reports.report_key(fleet[0]), "pdf", b"%PDF-pregenerated")
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch("power.views.report_cache", report_cache), \
+                mock.patch.object(reports, "render_report_cached", side_effect=AssertionError("cache miss")):
+            response = client.get("/power/report/export/", {"year": 2024, "month": 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-pregenerated")
+        response.close()
@@ -1,6 +1,8 @@
 from django.urls import path
 from .views import TrendDayView, TrendMonthView, SaveClientDataView, TodayUsageView, UserUsageView, TrendWeekView, \
-    PowerDetailView, BillView, AlertListView, PowerReportExportView
+    PowerDetailView, BillView, AlertListView, PowerReportExportView, TrendCompareView, \
+    TrendRangeView, FleetSummaryView, FleetTopView, FleetHistogramView, \
+    ReportJobView, ReportDownloadView
 
 urlpatterns = [
     path("usage/lastest-month", UserUsageView.as_view(), name="user-usage"),
@@ -8,9 +10,16 @@ urlpatterns = [
     path('trend/week', TrendWeekView.as_view()),
     path("today-usage/", TodayUsageView.as_view()),
     path('trend/month', TrendMonthView.as_view()),
+    path('trend/compare', TrendCompareView.as_view()),
+    path('trend/range', TrendRangeView.as_view()),
+    path('fleet/summary', FleetSummaryView.as_view()),
+    path('fleet/top', FleetTopView.as_view()),
+    path('fleet/histogram', FleetHistogramView.as_view()),
     path('save-client-data', SaveClientDataView.as_view()),
     path("detail/", PowerDetailView.as_view()),
     path("bill/", BillView.as_view()),
     path("alerts/", AlertListView.as_view()),
     path("report/export/", PowerReportExportView.as_view()),
+    path("report/jobs/<str:job_id>/", ReportJobView.as_view(), name="report-job"),
+    path("report/jobs/<str:job_id>/download/", ReportDownloadView.as_view(), name="report-download"),
 ]
@@ -0,0 +1,149 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connection
+
+
+def _conflict_clause(model, key_fields, value_fields, increment):
+    """唯一键冲突时的更新子句（MySQL: ON DUPLICATE KEY，PostgreSQL/SQLite: ON CONFLICT）"""
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table = qn(opts.db_table)
+    key_cols = [qn(opts.get_field(f).column) for f in key_fields]
+    value_cols = [qn(opts.get_field(f).column) for f in value_fields]
+
+    if connection.vendor == "mysql":
+        if increment:
+            sets = [f"{c} = {c} + VALUES({c})" for c in value_cols]
+        else:
+            sets = [f"{c} = VALUES({c})" for c in value_cols]
+        return " ON DUPLICATE KEY UPDATE " + ", ".join(sets)
+
+    if increment:
+        sets = [f"{c} = {table}.{c} + excluded.{c}" for c in value_cols]
+    else:
+        sets = [f"{c} = excluded.{c}" for c in value_cols]
+    return f" ON CONFLICT ({', '.join(key_cols)}) DO UPDATE SET " + ", ".join(sets)
+
+
+def _insert_head(model, fields):
+    qn = connection.ops.quote_name
+    opts = model._meta
+    cols = [qn(opts.get_field(f).column) for f in fields]
+    return f"INSERT INTO {qn(opts.db_table)} ({', '.join(cols)})"
+
+
+def _upsert_sql(model, key_fields, value_fields, count, increment):
+    """生成 INSERT ... VALUES ... ON DUPLICATE KEY / ON CONFLICT 语句"""
+    fields = list(key_fields) + list(value_fields)
+    row = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    return (
+        _insert_head(model, fields)
+        + " VALUES " + ", ".join([row] * count)
+        + _conflict_clause(model, key_fields, value_fields, increment)
+    )
+
+
+def upsert_from_select(model, key_fields, value_fields, select_sql, params=()):
+    """
+    INSERT INTO model (key..., value...) <select_sql> 按唯一键覆盖更新，整条语句在数据库端完成。
+    select_sql 的输出列顺序须与 key_fields + value_fields 一致，且必须带 WHERE 子句
+    （SQLite 解析 INSERT ... SELECT ... ON CONFLICT 的要求）。
+    返回数据库报告的受影响行数（cursor.rowcount），不是写入的行数：
+    MySQL 的 ON DUPLICATE KEY UPDATE 中被更新的行计 2、值未变的行计 0。
+    """
+    sql = (
+        _insert_head(model, list(key_fields) + list(value_fields))
+        + " " + select_sql
+        + _conflict_clause(model, key_fields, value_fields, False)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def bulk_upsert(model, key_fields, value_fields, rows, increment=False, batch_size=500):
+    """
+    按唯一键批量写入，一条语句完成插入或更新（原子操作）。
+
+    rows: [(key1, key2, ..., value1, ...), ...]，顺序与 key_fields + value_fields 一致
+    increment: True 时在已有值上累加（kwh = kwh + 新值），否则直接覆盖
+    """
+    if not rows:
+        return 0
+
+    fields = [model._meta.get_field(f) for f in list(key_fields) + list(value_fields)]
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            params = []
+            for row in chunk:
+                params.extend(
+                    f.get_db_prep_value(v, connection) for f, v in zip(fields, row)
+                )
+            cursor.execute(
+                _upsert_sql(model, key_fields, value_fields, len(chunk), increment),
+                params,
+            )
+
+    return len(rows)
+
+
+def bulk_increment(model, key_fields, value_field, rows, batch_size=500):
+    """bulk_upsert 的累加版本：rows 为 [(key..., delta), ...]"""
+    return bulk_upsert(model, key_fields, [value_field], rows, increment=True, batch_size=batch_size)
+
+
+def rollup_daily(start, end, lo, hi):
+    """按 HourlyUsage 覆盖写入 [start, end] 内、电表 id 在 [lo, hi] 的 DailyUsage（一条 INSERT ... SELECT）"""
+    from power.models import DailyUsage, HourlyUsage
+
+    hourly = connection.ops.quote_name(HourlyUsage._meta.db_table)
+    return upsert_from_select(
+        DailyUsage, ["meter", "day"], ["kwh"],
+        f"SELECT meter_id, day, SUM(kwh) FROM {hourly} "
+        f"WHERE day BETWEEN %s AND %s AND meter_id BETWEEN %s AND %s "
+        f"GROUP BY meter_id, day",
+        [start, end, lo, hi],
+    )
+
+
+def rollup_monthly(year, month, lo, hi):
+    """按 DailyUsage 覆盖写入 year-month、电表 id 在 [lo, hi] 的 MonthlyUsage（一条 INSERT ... SELECT）"""
+    import calendar
+    from datetime import date
+    from power.models import DailyUsage, MonthlyUsage
+
+    daily = connection.ops.quote_name(DailyUsage._meta.db_table)
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    return upsert_from_select(
+        MonthlyUsage, ["meter", "year", "month"], ["kwh"],
+        f"SELECT meter_id, %s, %s, SUM(kwh) FROM {daily} "
+        f"WHERE day BETWEEN %s AND %s AND meter_id BETWEEN %s AND %s "
+        f"GROUP BY meter_id",
+        [year, month, first, last, lo, hi],
+    )
+
+
+def rollup_fleet_hourly(start, end):
+    """按 HourlyUsage 覆盖写入 [start, end] 内的 FleetHourlyUsage（全部电表合计，一条 INSERT ... SELECT）"""
+    from power.models import FleetHourlyUsage, HourlyUsage
+
+    hourly = connection.ops.quote_name(HourlyUsage._meta.db_table)
+    return upsert_from_select(
+        FleetHourlyUsage, ["day", "hour"], ["kwh"],
+        f"SELECT day, hour, SUM(kwh) FROM {hourly} "
+        f"WHERE day BETWEEN %s AND %s "
+        f"GROUP BY day, hour",
+        [start, end],
+    )
+
+
+def fork_pool(workers):
+    """
+    管理命令的并行进程池，显式使用 fork 启动子进程：子进程直接继承已初始化的 Django，
+    任务函数所在模块在顶层导入了 models，spawn 启动的子进程无法导入。
+    调用前须 connections.close_all()，子进程各自重新连接数据库。
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
@@ -1,49 +1,30 @@
-import os
-import time
 import calendar
 from datetime import date, datetime, timedelta
 from django.core.paginator import Paginator
 from django.db import models
+from django.db.models.functions import Floor
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.utils.timezone import now
-from .models import (Meter, DailyUsage, MonthlyUsage, ClientMeterSnapshot, HourlyUsage, RealtimeAlert)
+from .models import (Meter, DailyUsage, MonthlyUsage, ClientMeterSnapshot, HourlyUsage, RealtimeAlert,
+                     FleetHourlyUsage, Bill)
 from .serializers import MonthlyUsageSerializer
-from system.utils import get_float_option
-from django.http import HttpResponse
+from monitor.state import meter_states
+from monitor.registry import meter_registry
+from .cache import trend_cache
+from . import analytics
+from .billing import get_tariff
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework.views import APIView
-from io import BytesIO
-import matplotlib
-matplotlib.use('Agg')
-import os
-import matplotlib.pyplot as plt
-from matplotlib import font_manager, rcParams
 from django.conf import settings
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage, PageBreak
-)
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from .models import MonthlyUsage
-
-
-# ========== 1. 注册中文字体（仿宋） ==========
-FONT_PATH = os.path.join(
-    settings.BASE_DIR, 'static', 'fonts', 'simfang.ttf'
-)
-pdfmetrics.registerFont(TTFont('Chinese', FONT_PATH))
-
-
-# ========== 2. matplotlib 使用同一字体 ==========
-font_prop = font_manager.FontProperties(fname=FONT_PATH)
-rcParams['font.family'] = font_prop.get_name()
-rcParams['axes.unicode_minus'] = False
+from django.http import FileResponse
+from django.urls import reverse
+from . import reports
+from .reports import report_cache, report_jobs
+
 
 def get_user_meter(request):
     meter_id = request.GET.get("meter_id")
@@ -62,105 +43,39 @@ def get_user_meter(request):
     return meter
 
 
-def process_meter_update(meter, power_w):
-    now_ts = time.time()
-    now_day = date.today()
-
-    if meter.last_ts == 0:
-        meter.last_ts = now_ts
-        meter.last_power_w = power_w
-        meter.save()
-        return 0
-
-    # ------  检查是否跨天了 -------
-    last_day = datetime.fromtimestamp(meter.last_ts).date()
-    if last_day != now_day:
-        process_new_day(meter, last_day)
-
-    # ------ 正常增量计算 -------
-    delta = now_ts - meter.last_ts
-    if delta <= 0:
-        return 0
-
-    added_kwh = power_w * (delta / 3600.0)
-
-    meter.energy_today += added_kwh
-    meter.last_ts = now_ts
-    meter.last_power_w = power_w
-    meter.save()
-
-    return added_kwh
-
-def process_new_day(meter, last_day):
-    """处理跨天事件：将 meter.energy_today 写入昨日的 DailyUsage"""
-
-    # ---- 写入昨日 DailyUsage ----
-    daily, _ = DailyUsage.objects.get_or_create(
-        meter=meter,
-        day=last_day,
-        defaults={"kwh": 0}
-    )
-    daily.kwh = meter.energy_today
-    daily.save()
-
-    # ---- 写 MonthlyUsage ----
-    month_obj, _ = MonthlyUsage.objects.get_or_create(
-        meter=meter,
-        year=last_day.year,
-        month=last_day.month,
-        defaults={"kwh": 0}
-    )
-
-    total_month = (
-        DailyUsage.objects.filter(
-            meter=meter,
-            day__year=last_day.year,
-            day__month=last_day.month
-        ).aggregate(total=models.Sum("kwh"))["total"] or 0
-    )
-
-    month_obj.kwh = total_month
-    month_obj.save()
-
-    # ---- 第二天清零 ----
-    meter.energy_today = 0
-    meter.save()
-
-
-def update_usages(meter):
-    today = date.today()
-
-    # Daily
-    daily, _ = DailyUsage.objects.get_or_create(
-        meter=meter,
-        day=today,
-        defaults={"kwh": 0}
-    )
-    daily.kwh = meter.energy_today
-    daily.save()
-
-    # Monthly
-    month_obj, _ = MonthlyUsage.objects.get_or_create(
-        meter=meter,
-        year=today.year,
-        month=today.month,
-        defaults={"kwh": 0}
-    )
-
-    this_month_kwh = (
-        DailyUsage.objects
-        .filter(meter=meter, day__year=today.year, day__month=today.month)
-        .aggregate(total=models.Sum("kwh"))["total"] or 0
-    )
-
-    month_obj.kwh = this_month_kwh
-    month_obj.save()
+def conditional_get(request, versions, view, meter, period, current, build, private=False, last_day=None):
+    """
+    HTTP 条件请求：用趋势缓存的版本号生成 ETag / Last-Modified，
+    客户端带 If-None-Match / If-Modified-Since 且数据未变时直接返回 304，不查库也不序列化。
+    last_day（周期最后一天）已由 close_day 结算的周期下发 max-age，其余周期要求每次校验（no-cache）：
+    0 点之后、日结之前晚到的读数仍会改写昨天的数据。
+    """
+    if versions is None:
+        return build()
+
+    etag, last_modified = trend_cache.validators(versions, view, meter.pk, period, current)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build()
+    # 304 同样带上校验器，客户端据此更新缓存
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+
+    directives = {"private": True} if private else {"public": True}
+    if current or last_day is None or not trend_cache.is_closed(last_day):
+        directives["no_cache"] = True
+    else:
+        directives["max_age"] = getattr(settings, "HTTP_CLOSED_PERIOD_MAX_AGE", 3600)
+    patch_cache_control(response, **directives)
+    if private:
+        patch_vary_headers(response, ["Authorization"])
+    return response
 
 
 class TodayUsageView(APIView):
     def get(self, request):
         meter_id = request.GET.get("meter_id")
-        meter = Meter.objects.get(meter_id=meter_id)
+        meter = meter_states.load(Meter.objects.get(meter_id=meter_id))
 
         return Response({
             "meter_id": meter_id,
@@ -171,7 +86,7 @@ class TodayUsageView(APIView):
 class TrendDayView(APIView):
     def get(self, request):
         meter_id = request.GET.get("meter_id")
-        meter = Meter.objects.filter(meter_id=meter_id).first()
+        meter = meter_registry.get(meter_id)
 
         if not meter:
             return Response({"error": "meter not found"}, status=404)
@@ -182,49 +97,25 @@ class TrendDayView(APIView):
         else:
             day = date.today()
 
-        # ⭐ 查询当天每小时的用电量
-        hourly_qs = HourlyUsage.objects.filter(
-            meter=meter,
-            day=day
+        period, current = day.isoformat(), day >= date.today()
+        versions = trend_cache.versions(meter.pk)
+        return conditional_get(
+            request, versions, "day", meter, period, current,
+            lambda: Response(trend_cache.get_or_compute(
+                "day", meter.pk, period, current, lambda: self.build(meter, day), versions,
+            )),
+            last_day=day,
         )
 
-        # key = hour, value = kwh
-        usage_map = {h.hour: h.kwh for h in hourly_qs}
-
-        # 24小时 x/y
-        x = [f"{h:02d}:00" for h in range(24)]
-        y = [round(usage_map.get(h, 0), 4) for h in range(24)]
-
-        total = sum(y)
-        avg = total / 24 if total else 0
+    def build(self, meter, day):
+        x, rows = analytics.trend_day([meter.pk], day)
+        return {"meter_id": meter.meter_id, "x": x, **rows[0]}
 
-        peak_kwh = max(y)
-        peak_hour = x[y.index(peak_kwh)]
-
-        valley_kwh = min(y)
-        valley_hour = x[y.index(valley_kwh)]
-
-        night_kwh = sum(y[0:6])
-        night_ratio = night_kwh / total if total else 0
-
-        return Response({
-            "meter_id": meter_id,
-            "x": x,
-            "y": y,
-            "analysis": {
-                "total_kwh": round(total, 4),
-                "avg_kwh": round(avg, 4),
-                "peak_hour": peak_hour,
-                "peak_kwh": round(peak_kwh, 4),
-                "valley_hour": valley_hour,
-                "night_ratio": round(night_ratio, 4),
-            }
-        })
 
 class TrendWeekView(APIView):
     def get(self, request):
         meter_id = request.GET.get("meter_id")
-        meter = Meter.objects.filter(meter_id=meter_id).first()
+        meter = meter_registry.get(meter_id)
 
         if not meter:
             return Response({"error": "meter not found"}, status=404)
@@ -236,70 +127,19 @@ class TrendWeekView(APIView):
         else:
             end_day = date.today()
 
-        start_day = end_day - timedelta(days=6)
-
-        qs = DailyUsage.objects.filter(
-            meter=meter,
-            day__range=(start_day, end_day)
+        period, current = end_day.isoformat(), end_day >= date.today()
+        versions = trend_cache.versions(meter.pk)
+        return conditional_get(
+            request, versions, "week", meter, period, current,
+            lambda: Response(trend_cache.get_or_compute(
+                "week", meter.pk, period, current, lambda: self.build(meter, end_day), versions,
+            )),
+            last_day=end_day,
         )
 
-        usage_map = {d.day: d.kwh for d in qs}
-
-        x = []
-        y = []
-
-        curr = start_day
-        while curr <= end_day:
-            x.append(curr.strftime("%Y-%m-%d"))
-            y.append(round(usage_map.get(curr, 0), 4))
-            curr += timedelta(days=1)
-
-        total_kwh = round(sum(y), 4)
-        avg_daily_kwh = round(total_kwh / 7, 4) if total_kwh else 0
-
-        max_kwh = max(y)
-        min_kwh = min(y)
-
-        max_day = x[y.index(max_kwh)]
-        min_day = x[y.index(min_kwh)]
-
-        fluctuation = round(max_kwh - min_kwh, 4)
-
-        workday_values = []
-        weekend_values = []
-
-        curr = start_day
-        for v in y:
-            if curr.weekday() < 5:
-                workday_values.append(v)
-            else:
-                weekend_values.append(v)
-            curr += timedelta(days=1)
-
-        workday_avg = round(
-            sum(workday_values) / len(workday_values), 4
-        ) if workday_values else 0
-
-        weekend_avg = round(
-            sum(weekend_values) / len(weekend_values), 4
-        ) if weekend_values else 0
-
-        return Response({
-            "meter_id": meter_id,
-            "x": x,
-            "y": y,
-            "analysis": {
-                "total_kwh": total_kwh,
-                "avg_daily_kwh": avg_daily_kwh,
-                "max_day": max_day,
-                "max_kwh": round(max_kwh, 4),
-                "min_day": min_day,
-                "min_kwh": round(min_kwh, 4),
-                "fluctuation": fluctuation,
-                "workday_avg": workday_avg,
-                "weekend_avg": weekend_avg,
-            }
-        })
+    def build(self, meter, end_day):
+        x, rows = analytics.trend_week([meter.pk], end_day)
+        return {"meter_id": meter.meter_id, "x": x, **rows[0]}
 
 
 class TrendMonthView(APIView):
@@ -316,75 +156,266 @@ class TrendMonthView(APIView):
             year = int(year)
             month = int(month)
 
-        meter = Meter.objects.filter(meter_id=meter_id).first()
+        meter = meter_registry.get(meter_id)
         if not meter:
             return Response({"error": "meter not found"}, status=404)
 
-        days_in_month = calendar.monthrange(year, month)[1]
-
-        qs = DailyUsage.objects.filter(
-            meter=meter,
-            day__year=year,
-            day__month=month
+        today = date.today()
+        period, current = f"{year}-{month:02d}", (year, month) >= (today.year, today.month)
+        versions = trend_cache.versions(meter.pk)
+        return conditional_get(
+            request, versions, "month", meter, period, current,
+            lambda: Response(trend_cache.get_or_compute(
+                "month", meter.pk, period, current, lambda: self.build(meter, year, month), versions,
+            )),
+            last_day=date(year, month, calendar.monthrange(year, month)[1]),
         )
 
-        usage_map = {d.day.day: d.kwh for d in qs}
+    def build(self, meter, year, month):
+        x, rows = analytics.trend_month([meter.pk], year, month)
+        return {"meter_id": meter.meter_id, "x": x, **rows[0]}
 
-        x = []
-        y = []
 
-        for d in range(1, days_in_month + 1):
-            dt = date(year, month, d)
-            x.append(dt.strftime("%Y-%m-%d"))
-            y.append(round(usage_map.get(d, 0), 4))
+class TrendCompareView(APIView):
+    """
+    多电表趋势对比：?meter_ids=a,b,c&view=day|week|month，
+    日期参数与单表接口相同（day: date，week: end，month: year/month），一次查询返回全部电表。
+    """
 
-        total_kwh = round(sum(y), 4)
-        avg_daily_kwh = round(
-            total_kwh / days_in_month, 4
-        ) if total_kwh else 0
-
-        max_kwh = max(y)
-        min_kwh = min(y)
+    def get(self, request):
+        meter_ids = []
+        for value in request.GET.getlist("meter_ids"):
+            meter_ids.extend(m.strip() for m in value.split(",") if m.strip())
+        meter_ids = list(dict.fromkeys(meter_ids))
+
+        if not meter_ids:
+            return Response({"error": "meter_ids 不能为空"}, status=400)
+        limit = getattr(settings, "TREND_COMPARE_MAX_METERS", 1000)
+        if len(meter_ids) > limit:
+            return Response({"error": f"一次最多对比 {limit} 块电表"}, status=400)
+
+        view = request.GET.get("view", "day")
+        today = date.today()
+        try:
+            if view == "day":
+                day = request.GET.get("date")
+                day = datetime.strptime(day, "%Y-%m-%d").date() if day else today
+            elif view == "week":
+                end_day = request.GET.get("end")
+                end_day = datetime.strptime(end_day, "%Y-%m-%d").date() if end_day else today
+            elif view == "month":
+                year = int(request.GET.get("year") or today.year)
+                month = int(request.GET.get("month") or today.month)
+                date(year, month, 1)
+            else:
+                return Response({"error": "view 只能是 day / week / month"}, status=400)
+        except ValueError:
+            return Response({"error": "日期参数格式错误"}, status=400)
+
+        found = dict(Meter.objects.filter(meter_id__in=meter_ids).values_list("meter_id", "id"))
+        ids = [m for m in meter_ids if m in found]
+        pks = [found[m] for m in ids]
+
+        if view == "day":
+            x, rows = analytics.trend_day(pks, day)
+        elif view == "week":
+            x, rows = analytics.trend_week(pks, end_day)
+        else:
+            x, rows = analytics.trend_month(pks, year, month)
 
-        max_day = x[y.index(max_kwh)]
-        min_day = x[y.index(min_kwh)]
+        return Response({
+            "view": view,
+            "x": x,
+            "meters": [{"meter_id": m, **row} for m, row in zip(ids, rows)],
+            "missing": [m for m in meter_ids if m not in found],
+        })
 
-        # top 3 days
-        top3_idx = sorted(
-            range(len(y)),
-            key=lambda i: y[i],
-            reverse=True
-        )[:3]
 
-        top3_days = [
-            {"day": x[i], "kwh": round(y[i], 4)}
-            for i in top3_idx
-        ]
+class TrendRangeView(APIView):
+    """
+    任意时间范围趋势：?meter_id=&start=YYYY-MM-DD&end=YYYY-MM-DD&max_points=500[&resolution=hour|day|month]
+    不指定 resolution 时自动选择原始点数不超过 TREND_RANGE_MAX_RAW_POINTS 的最细粒度，
+    点数超过 max_points 时用 LTTB 降采样（保留峰谷形状）。
+    """
 
-        mid = days_in_month // 2
-        first_half_kwh = round(sum(y[:mid]), 4)
-        second_half_kwh = round(sum(y[mid:]), 4)
+    def get(self, request):
+        meter_id = request.GET.get("meter_id")
+        meter = meter_registry.get(meter_id)
+        if not meter:
+            return Response({"error": "meter not found"}, status=404)
 
-        half_compare = round(
-            second_half_kwh - first_half_kwh, 4
+        try:
+            start = datetime.strptime(request.GET.get("start", ""), "%Y-%m-%d").date()
+            end = datetime.strptime(request.GET.get("end", ""), "%Y-%m-%d").date()
+            max_points = int(request.GET.get("max_points", 500))
+        except ValueError:
+            return Response({"error": "start / end 应为 YYYY-MM-DD，max_points 应为整数"}, status=400)
+        if start > end:
+            return Response({"error": "start 不能晚于 end"}, status=400)
+        if max_points < 3:
+            return Response({"error": "max_points 至少为 3"}, status=400)
+
+        max_raw = getattr(settings, "TREND_RANGE_MAX_RAW_POINTS", 10000)
+        resolution = request.GET.get("resolution") or analytics.pick_resolution(start, end, max_raw)
+        if resolution not in analytics.RESOLUTIONS:
+            return Response({"error": "resolution 只能是 hour / day / month"}, status=400)
+        if resolution == "hour" and ((end - start).days + 1) * 24 > max_raw or \
+                resolution == "day" and (end - start).days + 1 > max_raw:
+            return Response({"error": f"范围过大，原始点数不能超过 {max_raw}"}, status=400)
+
+        period = f"{start}~{end}:{resolution}:{max_points}"
+        current = end >= date.today()
+        versions = trend_cache.versions(meter.pk)
+        return conditional_get(
+            request, versions, "range", meter, period, current,
+            lambda: Response(trend_cache.get_or_compute(
+                "range", meter.pk, period, current,
+                lambda: self.build(meter, start, end, resolution, max_points), versions,
+            )),
+            last_day=end,
         )
 
+    def build(self, meter, start, end, resolution, max_points):
+        x, y = analytics.range_series(meter.pk, start, end, resolution)
+        keep = analytics.lttb(y, max_points)
+
+        return {
+            "meter_id": meter.meter_id,
+            "resolution": resolution,
+            "start": start,
+            "end": end,
+            "raw_points": len(y),
+            "downsampled": len(keep) < len(y),
+            "total_kwh": round(float(y.sum()), 4),
+            "x": [x[i] for i in keep.tolist()],
+            "y": [round(v, 4) for v in y[keep].tolist()],
+        }
+
+
+def fleet_period(request, allowed=("hour", "day", "month")):
+    """
+    解析全网统计的周期参数：?period=hour&date=&hour= / ?period=day&date= / ?period=month&year=&month=
+    返回 (period, 周期描述, 该周期每块电表用电量的 QuerySet, (起始日, 结束日))，参数错误抛 ValueError
+    """
+    period = request.GET.get("period", "day")
+    if period not in allowed:
+        raise ValueError(f"period 只能是 {' / '.join(allowed)}")
+
+    today = date.today()
+    if period == "month":
+        year = int(request.GET.get("year") or today.year)
+        month = int(request.GET.get("month") or today.month)
+        first = date(year, month, 1)
+        last = date(year, month, calendar.monthrange(year, month)[1])
+        return period, f"{year}-{month:02d}", MonthlyUsage.objects.filter(year=year, month=month), (first, last)
+
+    day = request.GET.get("date")
+    day = datetime.strptime(day, "%Y-%m-%d").date() if day else today
+    if period == "day":
+        return period, day.isoformat(), DailyUsage.objects.filter(day=day), (day, day)
+
+    hour = int(request.GET.get("hour", datetime.now().hour))
+    if not 0 <= hour < 24:
+        raise ValueError("hour 应为 0~23")
+    return period, f"{day} {hour:02d}:00", HourlyUsage.objects.filter(day=day, hour=hour), (day, day)
+
+
+class FleetSummaryView(APIView):
+    """全网用电概览（运维用）：总量、电表数、有用电的电表数、人均，以及全网曲线（日：每小时，月：每天）"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            period, label, per_meter, (start, end) = fleet_period(request, allowed=("day", "month"))
+        except ValueError as e:
+            return Response({"error": str(e) or "参数格式错误"}, status=400)
+
+        if period == "day":
+            usage_map = dict(FleetHourlyUsage.objects.filter(day=start).values_list("hour", "kwh"))
+            x = [f"{h:02d}:00" for h in range(24)]
+            y = [round(usage_map.get(h, 0), 4) for h in range(24)]
+        else:
+            usage_map = dict(
+                FleetHourlyUsage.objects.filter(day__range=(start, end))
+                .values("day").annotate(total=models.Sum("kwh")).values_list("day", "total")
+            )
+            days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+            x = [d.strftime("%Y-%m-%d") for d in days]
+            y = [round(usage_map.get(d, 0), 4) for d in days]
+
+        total = round(sum(y), 4)
+        active = per_meter.filter(kwh__gt=0).count()
+        peak = max(range(len(y)), key=lambda i: y[i])
+
         return Response({
-            "meter_id": meter_id,
+            "period": period,
+            "label": label,
+            "total_kwh": total,
+            "meters": Meter.objects.count(),
+            "active_meters": active,
+            "avg_kwh_per_meter": round(total / active, 4) if active else 0,
+            "peak": {"x": x[peak], "kwh": y[peak]},
             "x": x,
             "y": y,
-            "analysis": {
-                "total_kwh": total_kwh,
-                "avg_daily_kwh": avg_daily_kwh,
-                "max_day": max_day,
-                "max_kwh": round(max_kwh, 4),
-                "min_day": min_day,
-                "min_kwh": round(min_kwh, 4),
-                "top3_days": top3_days,
-                "first_half_kwh": first_half_kwh,
-                "second_half_kwh": second_half_kwh,
-                "half_compare": half_compare,
-            }
+        })
+
+
+class FleetTopView(APIView):
+    """用电量排名（运维用）：?period=...&n=10&order=desc|asc"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            period, label, per_meter, _ = fleet_period(request)
+            n = min(max(int(request.GET.get("n", 10)), 1), 1000)
+        except ValueError as e:
+            return Response({"error": str(e) or "参数格式错误"}, status=400)
+
+        order = "kwh" if request.GET.get("order") == "asc" else "-kwh"
+        rows = per_meter.order_by(order).values_list("meter__meter_id", "kwh")[:n]
+
+        return Response({
+            "period": period,
+            "label": label,
+            "results": [
+                {"rank": i + 1, "meter_id": meter_id, "kwh": round(kwh, 4)}
+                for i, (meter_id, kwh) in enumerate(rows)
+            ],
+        })
+
+
+class FleetHistogramView(APIView):
+    """用电量分布直方图（运维用）：?period=...&bins=20，等宽分桶，GROUP BY 在数据库端完成"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            period, label, per_meter, _ = fleet_period(request)
+            bins = min(max(int(request.GET.get("bins", 20)), 1), 200)
+        except ValueError as e:
+            return Response({"error": str(e) or "参数格式错误"}, status=400)
+
+        agg = per_meter.aggregate(lo=models.Min("kwh"), hi=models.Max("kwh"), n=models.Count("id"))
+        counts = [0] * bins
+        edges = []
+        if agg["n"]:
+            lo, hi = agg["lo"], agg["hi"]
+            width = (hi - lo) / bins or 1
+            buckets = (
+                per_meter.annotate(bucket=Floor((models.F("kwh") - lo) / width))
+                .values("bucket").annotate(count=models.Count("id")).values_list("bucket", "count")
+            )
+            for bucket, count in buckets:
+                # 最大值正好落在右边界上，归入最后一个桶
+                counts[min(int(bucket), bins - 1)] += count
+            edges = [round(lo + width * i, 4) for i in range(bins + 1)]
+
+        return Response({
+            "period": period,
+            "label": label,
+            "meters": agg["n"],
+            "edges": edges,
+            "counts": counts,
         })
 
 
@@ -405,15 +436,26 @@ class UserUsageView(ListAPIView):
         )
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        queryset = list(self.get_queryset())
+        if not queryset:
+            return Response([])
+
+        # 电费取自账单（Bill）；尚未结算的月份按当前电价估算
+        fees = {
+            (y, m): fee for y, m, fee in Bill.objects.filter(
+                meter_id=queryset[0].meter_id, year__gte=queryset[-1].year,
+            ).values_list("year", "month", "total_fee")
+        }
+        tariff = get_tariff()
 
         result = []
         for item in queryset:
+            fee = fees.get((item.year, item.month))
             result.append({
                 "year": item.year,
                 "month": item.month,
                 "kwh": float(item.kwh),
-                "money": float(item.kwh) * 0.65
+                "money": fee if fee is not None else round(tariff.estimate(item.kwh), 2),
             })
 
         return Response(result)
@@ -429,9 +471,7 @@ class SaveClientDataView(APIView):
             return Response({"error": "meter_id missing"}, status=400)
 
         # 查找电表
-        meter = Meter.objects.filter(meter_id=meter_id).first()
-        if not meter:
-            meter = Meter.objects.create(meter_id=meter_id)
+        meter, _ = meter_registry.get_or_create(meter_id)
 
         latest = request.data.get("latest") or {}
         series = request.data.get("realtime_series") or []
@@ -471,6 +511,12 @@ class PowerDetailView(APIView):
         else:
             day = date.today()
 
+        return conditional_get(
+            request, trend_cache.versions(meter.pk), "detail", meter, day.isoformat(),
+            day >= date.today(), lambda: self.build(meter, day), private=True, last_day=day,
+        )
+
+    def build(self, meter, day):
         # 3) 查询该天所有小时用电数据
         qs = HourlyUsage.objects.filter(
             meter=meter,
@@ -497,19 +543,43 @@ class BillView(APIView):
         if not meter:
             return Response({"error": "No meter found"}, status=404)
 
-        qs = MonthlyUsage.objects.filter(
-            meter=meter
-        ).order_by("-year", "-month")
+        # 包含当月，始终按当前周期处理（每次校验）；
+        # 未结算部分按当前电价估算，电价调整后即使用电数据未变也要重新生成
+        tariff = get_tariff()
+        return conditional_get(
+            request, trend_cache.versions(meter.pk), "bill", meter, f"all:{tariff.digest}", True,
+            lambda: self.build(meter, tariff), private=True,
+        )
 
-        bills = []
-        for m in qs:
-            price = round(m.kwh * 0.65, 2)
+    def build(self, meter, tariff):
+        """
+        账单由 close_day / generate_bills 预先计算（Bill）；MonthlyUsage 实时累加，
+        没有账单的月份（如未回填的历史月份）按当前电价估算，
+        当月上次结算之后新增的用电量按当前电价估算后计入，两者都标记 estimated
+        """
+        billed = {
+            (year, month): (kwh, fee) for year, month, kwh, fee in
+            Bill.objects.filter(meter=meter).values_list("year", "month", "total_kwh", "total_fee")
+        }
+        usage = dict(
+            ((year, month), kwh) for year, month, kwh in
+            MonthlyUsage.objects.filter(meter=meter).values_list("year", "month", "kwh")
+        )
 
+        bills = []
+        for year, month in sorted(billed.keys() | usage.keys(), reverse=True):
+            kwh = usage.get((year, month), 0)
+            if (year, month) not in billed:
+                fee, estimated = tariff.estimate(kwh), True
+            else:
+                billed_kwh, fee = billed[(year, month)]
+                estimated = kwh > billed_kwh + 1e-6
+                if estimated:
+                    fee += tariff.estimate(kwh) - tariff.estimate(billed_kwh)
+                else:
+                    kwh = billed_kwh
             bills.append({
-                "year": m.year,
-                "month": m.month,
-                "kwh": round(m.kwh, 4),
-                "cost": price,
+                "year": year, "month": month, "kwh": round(kwh, 4), "cost": round(fee, 2), "estimated": estimated,
             })
 
         return Response({"bills": bills})
@@ -566,140 +636,100 @@ class AlertListView(APIView):
         })
 
 
+def report_job_payload(status):
+    payload = {
+        "job_id": status["job_id"],
+        "status": status["status"],
+        "status_url": reverse("report-job", args=[status["job_id"]]),
+    }
+    if status["status"] == "done":
+        payload["download_url"] = reverse("report-download", args=[status["job_id"]])
+    if status.get("error"):
+        payload["error"] = status["error"]
+    return payload
+
+
+def pdf_response(key):
+    """从报告缓存流式返回 PDF，缓存已被淘汰时返回 None"""
+    f = report_cache.open(key, "pdf")
+    if f is None:
+        return None
+    return FileResponse(
+        f,
+        as_attachment=True,
+        filename="家庭智能用电分析报告.pdf",
+        content_type="application/pdf",
+    )
+
+
 class PowerReportExportView(APIView):
+    """
+    导出用电分析报告：默认为最近 12 个月；带 year、month 参数时为截至该月 12 个自然月的月度报告
+    （generate_reports 每月预先生成，导出时直接命中缓存）。
+    数据未变化时直接返回缓存的 PDF；
+    数据不超过 REPORT_SYNC_MAX_MONTHS 个月或未启用任务池（REPORT_WORKERS = 0）时在请求内渲染后返回；
+    否则提交到后台进程池，返回 202 和任务信息，客户端轮询 status_url，完成后从 download_url 下载。
+    """
+    permission_classes = [IsAuthenticated]
+
     def get(self, request):
         meter = request.user.meters.first()
-        months = (
-            MonthlyUsage.objects
-            .filter(meter=meter)
-            .order_by('year', 'month')[:12]
-        )
+        if not meter:
+            return Response({"error": "用户未绑定任何电表"}, status=404)
 
-        # ========= 3. 统计数据 =========
-        total_kwh = sum(m.kwh for m in months)
-        price = 0.65
-        total_money = total_kwh * price
-        avg_daily = total_kwh / 30 if total_kwh else 0
-        avg_month = total_kwh / len(months) if months else 0
+        until = None
+        if request.GET.get("year") or request.GET.get("month"):
+            try:
+                until = (int(request.GET.get("year")), int(request.GET.get("month")))
+                date(*until, 1)
+            except (TypeError, ValueError):
+                return Response({"error": "year / month 参数格式错误"}, status=400)
 
-        # ========= 4. 生成趋势图 =========
-        labels = [f"{m.year}-{m.month:02d}" for m in months]
-        values = [m.kwh for m in months]
+        data = reports.report_data(meter, until)
+        response = pdf_response(reports.report_key(data))
+        if response:
+            return response
 
-        fig, ax = plt.subplots(figsize=(8, 4))
+        if not report_jobs.enabled or len(data["months"]) <= getattr(settings, "REPORT_SYNC_MAX_MONTHS", 1):
+            response = pdf_response(reports.render_report_cached(data))
+            if response:
+                return response
+            return Response({"error": "报告生成失败"}, status=500)
 
-        if len(values) < 2:
-            ax.scatter(labels, values, s=80)
-            ax.set_title("当前月用电量", fontproperties=font_prop)
-        else:
-            ax.plot(labels, values, marker='o', linewidth=2)
-            ax.set_title("最近 12 个月用电量趋势", fontproperties=font_prop)
-
-        ax.set_xlabel("月份", fontproperties=font_prop)
-        ax.set_ylabel("用电量 (kWh)", fontproperties=font_prop)
-        ax.grid(True, linestyle='--', alpha=0.6)
-        plt.xticks(rotation=45)
-
-        img_buf = BytesIO()
-        fig.savefig(img_buf, dpi=150, bbox_inches='tight')
-        img_buf.seek(0)
-        plt.close(fig)
-
-        # ========= 5. PDF 初始化 =========
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="家庭智能用电分析报告.pdf"'
-
-        doc = SimpleDocTemplate(
-            response,
-            pagesize=A4,
-            topMargin=2 * cm,
-            bottomMargin=2 * cm
-        )
+        job_id = report_jobs.submit(request.user.pk, data)
+        return Response(report_job_payload(report_jobs.status(job_id)), status=202)
 
-        styles = getSampleStyleSheet()
-        styles.add(ParagraphStyle(
-            name='TitleCN', fontName='Chinese',
-            fontSize=20, alignment=1, spaceAfter=20
-        ))
-        styles.add(ParagraphStyle(
-            name='NormalCN', fontName='Chinese',
-            fontSize=12, leading=18
-        ))
-        styles.add(ParagraphStyle(
-            name='HeadingCN', fontName='Chinese',
-            fontSize=14, spaceBefore=12, spaceAfter=8
-        ))
-
-        story = []
-
-        # ========= 6. 封面 / 标题 =========
-        story.append(Paragraph("家庭智能用电分析报告", styles['TitleCN']))
-        story.append(Spacer(1, 30))
-
-        story.append(Paragraph(
-            "本报告基于智能电表采集的历史用电数据，"
-            "对家庭用电情况进行统计分析与趋势评估，"
-            "为用户提供科学的用电决策参考。",
-            styles['NormalCN']
-        ))
-        story.append(PageBreak())
-
-        # ========= 7. 基本信息 =========
-        story.append(Paragraph("一、基本用电信息", styles['HeadingCN']))
-
-        info_table = Table([
-            ["电表编号", meter.meter_id],
-            ["统计周期", "最近 12 个月"],
-            ["总用电量", f"{total_kwh:.2f} kWh"],
-            ["总电费", f"¥{total_money:.2f}"],
-            ["日均用电量", f"{avg_daily:.2f} kWh"],
-            ["月均用电量", f"{avg_month:.2f} kWh"],
-        ], colWidths=[5 * cm, 9 * cm])
-
-        info_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), 'Chinese'),
-            ('FONTSIZE', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('BACKGROUND', (0, 0), (0, -1), colors.whitesmoke),
-        ]))
-
-        story.append(info_table)
-        story.append(Spacer(1, 20))
-
-        # ========= 8. 趋势分析 =========
-        story.append(Paragraph("二、用电趋势分析", styles['HeadingCN']))
-        story.append(RLImage(img_buf, width=15 * cm, height=8 * cm))
-        story.append(Spacer(1, 12))
-
-        story.append(Paragraph(
-            "从用电趋势图可以看出，家庭整体用电情况较为稳定，"
-            "未出现明显的异常峰值，说明家庭用电行为相对规律。",
-            styles['NormalCN']
-        ))
-
-        # ========= 9. 节能建议 =========
-        story.append(Spacer(1, 20))
-        story.append(Paragraph("三、节能建议", styles['HeadingCN']))
-
-        tips = [
-            "合理安排大功率电器的使用时间，避免集中使用。",
-            "选用高能效等级家用电器以降低长期用电成本。",
-            "夏季空调温度建议不低于 26℃，冬季不高于 20℃。",
-            "外出或长期不用时，及时关闭待机电器。"
-        ]
 
-        for tip in tips:
-            story.append(Paragraph(f"• {tip}", styles['NormalCN']))
-            story.append(Spacer(1, 6))
-
-        # ========= 10. 系统说明 =========
-        story.append(Spacer(1, 20))
-        story.append(Paragraph("四、系统说明", styles['HeadingCN']))
-        story.append(Paragraph(
-            "本分析报告由家庭智能用电监测系统自动生成，"
-            "可辅助用户了解用电行为并优化用电策略。",
-            styles['NormalCN']
-        ))
-
-        doc.build(story)
-        return response
\ No newline at end of file
+def get_user_report_job(request, job_id):
+    status = report_jobs.status(job_id)
+    if not status or status.get("owner") != request.user.pk:
+        return None
+    return status
+
+
+class ReportJobView(APIView):
+    """报告任务状态：pending / done / failed"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        status = get_user_report_job(request, job_id)
+        if not status:
+            return Response({"error": "任务不存在"}, status=404)
+        return Response(report_job_payload(status))
+
+
+class ReportDownloadView(APIView):
+    """下载已生成的报告"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        status = get_user_report_job(request, job_id)
+        if not status:
+            return Response({"error": "任务不存在"}, status=404)
+        if status["status"] != "done":
+            return Response(report_job_payload(status), status=409)
+
+        response = pdf_response(status["key"])
+        if not response:
+            return Response({"error": "报告已过期，请重新导出"}, status=410)
+        return response
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import SystemOption
+from .utils import option_cache
+
+
+@receiver(post_save, sender=SystemOption)
+@receiver(post_delete, sender=SystemOption)
+def option_changed(sender, instance, **kwargs):
+    """配置变更：本进程立即失效，事务提交后通知其他进程（提交前通知，其他进程可能重新加载到旧值）"""
+    option_cache.invalidate()
+    transaction.on_commit(option_cache.publish)
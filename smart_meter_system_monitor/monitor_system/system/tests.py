@@ -1,3 +1,53 @@
+from unittest import mock
 from django.test import TestCase
+from system.models import SystemOption
+from system.utils import option_cache, get_float_option, get_option
 
-# Create your tests here.
+
+class OptionCacheTests(TestCase):
+    def setUp(self):
+        # 测试事务回滚不触发失效信号
+        option_cache.invalidate()
+        self.addCleanup(option_cache.invalidate)
+
+    def test_loads_once(self):
+        SystemOption.objects.create(key="a", value="1")
+        option_cache.invalidate()
+        self.assertEqual(get_option("a"), "1")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_option("a"), "1")
+            self.assertEqual(get_option("missing", "x"), "x")
+
+    def test_save_invalidates_and_publishes(self):
+        option = SystemOption.objects.create(key="a", value="1")
+        self.assertEqual(get_option("a"), "1")
+        version = option_cache.version
+
+        option.value = "2"
+        with mock.patch.object(option_cache, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                option.save()
+                # 本进程立即失效，通知在事务提交后发出
+                self.assertEqual(get_option("a"), "2")
+                publish.assert_not_called()
+        publish.assert_called_once_with()
+        self.assertGreater(option_cache.version, version)
+
+        with mock.patch.object(option_cache, "publish"):
+            option.delete()
+        self.assertIsNone(get_option("a"))
+
+    def test_expires_after_ttl(self):
+        self.assertIsNone(get_option("a"))
+        # 其他进程修改配置且没有收到通知
+        SystemOption.objects.bulk_create([SystemOption(key="a", value="1")])
+        self.assertIsNone(get_option("a"))
+        with mock.patch.object(option_cache, "ttl", -1):
+            self.assertEqual(get_option("a"), "1")
+
+    def test_float_option(self):
+        SystemOption.objects.create(key="price", value="0.5")
+        SystemOption.objects.create(key="bad", value="abc")
+        self.assertEqual(get_float_option("price"), 0.5)
+        self.assertEqual(get_float_option("bad", 0.65), 0.65)
+        self.assertEqual(get_float_option("missing", 0.65), 0.65)
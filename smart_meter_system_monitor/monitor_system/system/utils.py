@@ -1,15 +1,120 @@
+import threading
+import time
+from django.conf import settings
 from .models import SystemOption
 
-def get_option(key, default=None):
+OPTION_CHANNEL = "system_options:changed"
+
+
+class OptionCache:
+    """
+    SystemOption 进程内缓存：一次查询加载全部配置，之后读取不再访问数据库。
+
+    失效方式：
+      - 本进程保存/删除配置时由 system.signals 立即失效，并通过 Redis 发布通知；
+      - 其他进程的后台线程订阅该频道，收到通知后失效本地缓存；
+      - Redis 不可用时退化为 TTL（OPTION_CACHE_TTL 秒）过期重新加载。
+    version 每次重新加载时递增，依赖配置编译出的对象（如告警规则）可据此判断是否需要重建。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = 0
+        self._values = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _load(self):
+        values = dict(SystemOption.objects.values_list("key", "value"))
+        with self._lock:
+            self._values = values
+            self._loaded_at = time.monotonic()
+            self.version += 1
+        return values
+
+    def all(self):
+        self._ensure_listener()
+        values = self._values
+        if values is None or time.monotonic() - self._loaded_at > self.ttl:
+            values = self._load()
+        return values
+
+    def get(self, key, default=None):
+        return self.all().get(key, default)
+
+    def invalidate(self):
+        with self._lock:
+            self._values = None
+
+    # ---------- 跨进程通知 ----------
+
+    def publish(self):
+        """通知其他进程配置已变更"""
+        try:
+            client = _redis_client()
+            if client is not None:
+                client.publish(OPTION_CHANNEL, "1")
+        except Exception as e:
+            print("option publish error:", e)
+
+    def _ensure_listener(self):
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(
+                target=self._listen, name="option-listener", daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                client = _redis_client()
+                if client is None:
+                    return   # 没有 redis 依赖，只靠 TTL
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(OPTION_CHANNEL)
+                # 订阅期间可能错过通知，订阅成功后主动失效一次
+                self.invalidate()
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.invalidate()
+            except Exception as e:
+                print("option listener error:", e)
+            time.sleep(5)
+
+    def stats(self):
+        return {
+            "size": len(self._values or {}),
+            "version": self.version,
+            "age": round(time.monotonic() - self._loaded_at, 1) if self._values is not None else None,
+            "ttl": self.ttl,
+        }
+
+
+def _redis_client():
+    url = getattr(settings, "REDIS_URL", None)
+    if not url:
+        return None
     try:
-        opt = SystemOption.objects.get(key=key)
-        return opt.value
-    except SystemOption.DoesNotExist:
-        return default
+        import redis
+    except ImportError:
+        return None
+    return redis.Redis.from_url(url)
+
+
+option_cache = OptionCache(getattr(settings, "OPTION_CACHE_TTL", 60))
+
+
+def get_option(key, default=None):
+    return option_cache.get(key, default)
 
 
 def get_float_option(key, default=0.0):
     try:
         return float(get_option(key, default))
     except ValueError:
-        return default
\ No newline at end of file
+        return default